@@ -8,7 +8,7 @@ from colorama import init, Fore, Back, Style
 import traceback
 import pyperclip
 from tabulate import tabulate
-import dcm_util, dcm_issue, dcm_repo
+import dcm_util, dcm_issue, dcm_repo, dcm_search
 import time
 
 class Cmd:
@@ -41,6 +41,8 @@ class Cmd:
   ISSUES_IGNORE_FILE_DB = 'ignore'
   ISSUES_FIX_FILE_DB = 'fix'
   ISSUES_OPEN_FILE = 'open'
+  ISSUES_WATCH = 'watch'
+  ISSUES_DUPLICATES = 'dups'
 
   # --- repo commands
   REPO_COLS = 'cols' # show/change shown column
@@ -139,7 +141,71 @@ def cmd_unselect(par):
 # Scan command
 def cmd_scan(repo):
   global dcmEnv, selEles, envEles
-  repo.scan()
+  print_moved(repo.scan(progress=print_progress))
+  repo.copy_issues_to_filtered()
+  selEles[dcmEnv] = []
+  cmd_show()
+
+#
+# print the progress of a long operation (on a single line)
+def print_progress(phase, done, total):
+  if total < 1000: return
+  print('\r' + phase + ': ' + str(done) + '/' + str(total), end='\n' if done == total else '')
+
+#
+# ask whether a journal left by a session that did not close can be set aside (the csv changed outside dcm)
+def ask_set_aside_journal(journal_path):
+  print_color(Fore.RED, 'the csv file changed outside dcm after ' + journal_path + ' was written, its changes cannot be applied')
+  ws = input_split_color(Fore.RED, 'set the journal aside (saved as .last) and open the csv as it is? (y/n) ')
+  return len(ws) > 0 and ws[0] == 'y'
+
+#
+# print the files moved/renamed found by a scan
+def print_moved(moved):
+  for old_url, new_url in moved:
+    print(old_url + ' --> ' + new_url + ' -- MOVED')
+
+#
+# print the documents matched by a search (an iterator of (rowid, url, ...)) as they are found, then keep
+# them in the filtered list; Ctrl-C stops the search keeping the ones found so far (return False)
+def print_search(repo, matches):
+  found = set()
+  complete = True
+  try:
+    for match in matches:
+      found.add(match[0])
+      print('found: ' + match[1])
+  except KeyboardInterrupt:
+    complete = False
+  finally:
+    matches.close()
+  repo.keep_filtered(found)
+  return complete
+
+#
+# print the hits of the last regex/whole word search (offsets of the first matches) of the shown rows
+def print_hits(repo, max_hits):
+  for i, row in enumerate(envEles[dcmEnv]):
+    hits = repo.search_hits.get(repo.get_rowid(row))
+    if hits is None: continue
+    count = str(len(hits)) + ('+' if len(hits) == max_hits else '')
+    print(str(i) + ': ' + count + ' hits at ' + ', '.join(map(str, hits)))
+
+#
+# print rank and snippet of the shown rows after a ranked search
+def print_ranks(repo, ranks):
+  rank_snippets = dict((rowid, (rank, snippet)) for rowid, rank, snippet in ranks)
+  for i, row in enumerate(envEles[dcmEnv]):
+    rank, snippet = rank_snippets.get(repo.get_rowid(row), (None, ''))
+    if rank is None: continue
+    print(str(i) + ': ' + ('%.2f' % rank) + ' ' + snippet)
+
+#
+# Duplicates command
+def cmd_duplicates(repo):
+  global dcmEnv, selEles, envEles
+  dups = repo.find_duplicates(progress=print_progress)
+  print(str(len(dups)) + ' duplicates found')
   repo.copy_issues_to_filtered()
   selEles[dcmEnv] = []
   cmd_show()
@@ -198,6 +264,8 @@ def input_split_color(c, s):
 # environment prompt
 def env_prompt():
   global dcmEnv, selEles, envEles
+
+  repo.apply_watch_events()
   
   msg = dcmEnv + ' [' + str(len(selEles[dcmEnv])) + '/' + str(len(envEles[dcmEnv])) + ']# '
   if dcmEnv == Cmd.ENV_ISSUES:
@@ -325,6 +393,8 @@ def printHelp(par):
     print('======= ' + par + ' =======')
     print(Cmd.CMD_HELP + ' [*]: print help message')
     print(Cmd.ISSUES_SCAN + ': scan the repository for new files or problems')
+    print(Cmd.ISSUES_WATCH + ': start/stop watching the repository for new files or problems')
+    print(Cmd.ISSUES_DUPLICATES + ': find files with the same content')
     print(Cmd.CMD_SHOW + ': show scanned files')
     print(Cmd.CMD_SELECT + ' <index1 index2 ...>|*: select scanned files')
     print()
@@ -354,18 +424,23 @@ def printHelp(par):
     print(Cmd.CMD_HELP + ' [*]: print help message')
     print(Cmd.CMD_SHOW + ': show filtered files')
     print(Cmd.ISSUES_SCAN + ': scan the repository for new files or problems')
+    print(Cmd.ISSUES_WATCH + ': start/stop watching the repository for new files or problems')
+    print(Cmd.ISSUES_DUPLICATES + ': find files with the same content')
     print(Cmd.REPO_FAVORITE + '  [<index>]: show favorites/toggle favor on selected item')
     print(Cmd.CMD_SELECT + ' <index1 index2 ...>|*: select filtered files')
     print()
     print(Cmd.REPO_COLS + ' [<colums>|*]: show/change shown column')
     print(Cmd.REPO_RESET + ': reset applied filters')
     print(Cmd.REPO_WHERE + ': show where clause')
-    print(Cmd.REPO_ORDER + ' [<column>]: show/change row order')
+    print(Cmd.REPO_ORDER + ' [<column> [ASC|DESC], ...]: show/change row order')
     print(Cmd.REPO_AND + ': sql and')
     print(Cmd.REPO_OR + ': sql or')
     print(Cmd.REPO_FILTER + ': filter UI')
     print(Cmd.REPO_ANY + ' <string1 string2 ...>: filter any item characterized with the all the items in the input string')
-    print(Cmd.REPO_SEARCH + ' <string>: search for documents that contains the input string')
+    print(Cmd.REPO_SEARCH + ' [-j<workers>] <query>: search for documents whose text matches the query (using workers concurrent text extractions)')
+    print('  query: words or "phrases" combined with AND (default), OR, NOT and parentheses')
+    print(Cmd.REPO_SEARCH + ' [-j<workers>] --rank <query>: search as above, sort the documents by relevance (rank column) and show text snippets')
+    print(Cmd.REPO_SEARCH + ' [-j<workers>] [-n<hits>] -r|-w|-r -w <pattern>: search for documents matching the regex (-r) and/or the whole word (-w), show the first hits (' + str(dcm_search.DEF_MAX_HITS) + ' by default)')
     print()
     print(Cmd.REPO_HTML + ' <filepath>: export selected items to html')
     print(Cmd.REPO_CSV + ' <filepath>: export selected items to csv')
@@ -420,6 +495,19 @@ def manageCmd(repo, inp_values, filters, ws):
       cmd_scan(repo)
       return
 
+    if ws[0] == Cmd.ISSUES_DUPLICATES:
+      cmd_duplicates(repo)
+      return
+
+    if ws[0] == Cmd.ISSUES_WATCH:
+      if repo.is_watching():
+        repo.watch_stop()
+        print('watch stopped')
+      else:
+        repo.watch_start()
+        print('watch started')
+      return
+
     if ws[0] == Cmd.ISSUES_ADD_FILE_DB:
       if envEles[dcmEnv] != repo.issues:
         print_error('issues environment required');
@@ -433,7 +521,7 @@ def manageCmd(repo, inp_values, filters, ws):
         print_error('this is not a NEW file');
         return
 
-      title = os.path.splitext(issue.url)[0].replace('_', ' ')
+      title = os.path.splitext(os.path.basename(issue.url))[0].replace('_', ' ')
       r, inp_values[Cmd.ITITLE], inp_values[Cmd.ILANG], inp_values[Cmd.ILABELS], inp_values[Cmd.IKEYWORDS] = get_rentry_input(title, inp_values[Cmd.ILANG], inp_values[Cmd.ILABELS], inp_values[Cmd.IKEYWORDS])
       if not r: return
 
@@ -451,7 +539,7 @@ def manageCmd(repo, inp_values, filters, ws):
       r, inp_values[Cmd.ITITLE], inp_values[Cmd.ILANG], inp_values[Cmd.ILABELS], inp_values[Cmd.IKEYWORDS] = get_rentry_input('---', inp_values[Cmd.ILANG], inp_values[Cmd.ILABELS], inp_values[Cmd.IKEYWORDS])
       if not r: return
 
-      resolve_issue(' added', lambda issue: repo.add_doc_db(issue, os.path.splitext(issue.url)[0].replace('_', ' '), inp_values[Cmd.ILANG], inp_values[Cmd.ILABELS], inp_values[Cmd.IKEYWORDS]))
+      resolve_issue(' added', lambda issue: repo.add_doc_db(issue, os.path.splitext(os.path.basename(issue.url))[0].replace('_', ' '), inp_values[Cmd.ILANG], inp_values[Cmd.ILABELS], inp_values[Cmd.IKEYWORDS]))
       return
 
     if ws[0] == Cmd.ISSUES_DEL_MISSING_DB:
@@ -537,7 +625,7 @@ def manageCmd(repo, inp_values, filters, ws):
 
     if ws[0] == Cmd.REPO_ORDER:
       if ws[1] != '': 
-        repo.orderby_clause = ' ORDER BY ' + ws[1];
+        repo.orderby_clause = ' ORDER BY ' + ' '.join(ws[1:]).strip() # e.g. ord rank DESC
         repo.update_filtered()
         #selEles[dcmEnv] = []
         cmd_show()
@@ -590,9 +678,37 @@ def manageCmd(repo, inp_values, filters, ws):
 
     if ws[0] == Cmd.REPO_SEARCH:
       if not check_1st_param(ws, True): return
-      repo.search_string(ws[1], True)
+      workers = dcm_search.DEF_WORKERS
+      is_regex = False
+      whole_word = False
+      ranked = False
+      max_hits = dcm_search.DEF_MAX_HITS
+      while ws[1] in ['-r', '-w', '--rank'] or (ws[1][:2] in ['-j', '-n'] and ws[1][2:].isdigit() and int(ws[1][2:]) > 0):
+        if ws[1] == '-r': is_regex = True
+        elif ws[1] == '-w': whole_word = True
+        elif ws[1] == '--rank': ranked = True
+        elif ws[1].startswith('-n'): max_hits = int(ws[1][2:])
+        else: workers = int(ws[1][2:])
+        ws = ws[1:] + ['']
+      if not check_1st_param(ws, True): return
+
+      s = ' '.join(ws[1:]).strip()
+      try:
+        if ranked:
+          ranks, complete = repo.search_ranked(s, True, workers)
+        elif is_regex or whole_word:
+          complete = print_search(repo, repo.iter_search_regex(s, True, whole_word, is_regex, max_hits, workers))
+        else:
+          complete = print_search(repo, repo.iter_search(s, True, workers))
+      except ValueError as ex:
+        print_error('invalid query: ' + str(ex))
+        return
+      if not complete:
+        print('search interrupted, partial results')
       selEles[dcmEnv] = []
       cmd_show()
+      if is_regex or whole_word: print_hits(repo, max_hits)
+      elif ranked: print_ranks(repo, ranks)
       return
 
     if ws[0] == Cmd.REPO_HTML:
@@ -600,8 +716,10 @@ def manageCmd(repo, inp_values, filters, ws):
       if not check_selected_elements(): return
 
       rowids = list(map(lambda se: repo.get_rowid(se), selEles[dcmEnv]))
-      repo.export_to_csv_html(rowids, ws[1], False)
-      print('html saved')
+      if repo.export_to_csv_html(rowids, ws[1], False):
+        print('html saved')
+      else:
+        print('html already up to date')
       return
 
     if ws[0] == Cmd.REPO_CSV:
@@ -609,8 +727,10 @@ def manageCmd(repo, inp_values, filters, ws):
       if not check_selected_elements(): return
 
       rowids = list(map(lambda se: repo.get_rowid(se), selEles[dcmEnv]))
-      repo.export_to_csv_html(rowids, ws[1], True)
-      print('csv saved')
+      if repo.export_to_csv_html(rowids, ws[1], True):
+        print('csv saved')
+      else:
+        print('csv already up to date')
       return
 
     if ws[0] == Cmd.REPO_FAVORITE:
@@ -748,6 +868,7 @@ def manageCmd(repo, inp_values, filters, ws):
 if __name__ == '__main__':
   if len(sys.argv) < 4:
     print('usage: ' + sys.argv[0] + ' <repo user> <repo csv file path> <repo dir path>')
+    print('  <repo csv file path>' + dcm_repo.RepoManager.IGNORE_SUFFIX + ' (optional): names or relative paths not scanned, one fnmatch pattern per line')
     exit()
 
   print('========================')
@@ -765,7 +886,9 @@ if __name__ == '__main__':
   
   # RepoManager
   repo = dcm_repo.RepoManager(repo_user, repo_csv_path, repo_dir_path)
-  repo.open()
+  if not repo.open(ask_set_aside_journal):
+    print('csv and journal left untouched, bye bye')
+    exit()
   
   t1 = time.time()
   total_time = t1-t0
@@ -782,11 +905,12 @@ if __name__ == '__main__':
   # initial scan
   t0 = time.time()
 
-  repo.scan()
+  moved = repo.scan(progress=print_progress)
   
   t1 = time.time()
   total_time = t1-t0
   print('repo scan time: ' + str(round(total_time / 1000, 1)))
+  print_moved(moved)
 
   if len(repo.issues) > 0:
     ws = input_split_color(Fore.RED, 'there are issues to fix (' + str(len(repo.issues)) + '), proceed? (y/n) ')
@@ -0,0 +1,163 @@
+#
+# Dcm benchmarks (usage: python dcm_bench.py <benchmark> [<size>])
+#
+
+import os
+import sys
+import time
+import random
+import tempfile
+import dcm_repo, dcm_html, dcm_scan, dcm_search
+
+#
+# write a synthetic repo csv file with n rows
+def make_csv(filepath, n):
+  labels = ['lab%d' % i for i in range(50)]
+  with open(filepath, 'w', newline='') as f:
+    f.write(dcm_repo.RepoManager.COLS_WRITE.replace(', ', ';') + '\n')
+    for i in range(n):
+      ls = ' '.join(random.sample(labels, random.randint(0, 4)))
+      f.write('doc;file_%d.pdf;title of document %d;01/12/2017;myuser;en;%s;;\n' % (i, i, ls))
+
+#
+# print a benchmark result
+def report(name, n, secs, unit='rows'):
+  print('%s: %d %s in %.3f s (%.0f %s/s)' % (name, n, unit, secs, n / secs if secs > 0 else 0, unit))
+
+#
+# benchmark: csv import in RepoManager.open()
+def bench_open(n):
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    csv_path = os.path.join(tmp_dir, 'repo.csv')
+    make_csv(csv_path, n)
+
+    repo = dcm_repo.RepoManager('bench', csv_path, tmp_dir)
+    t0 = time.time()
+    repo.db_conn.execute('CREATE TABLE resource (' + repo.COLS_TYPE + ')')
+    repo._import_csv()
+    report('csv import', n, time.time() - t0)
+    repo.db_conn.close()
+
+    # full open(): the first one imports the csv and fills the sidecar, the second one uses the sidecar
+    for name in ['open (import)', 'open (sidecar)']:
+      repo = dcm_repo.RepoManager('bench', csv_path, tmp_dir)
+      t0 = time.time()
+      repo.open()
+      report(name, n, time.time() - t0)
+      repo.db_conn.close()
+
+#
+# benchmark: RepoManager.close() after a single change (the html index is already up to date)
+def bench_close(n):
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    csv_path = os.path.join(tmp_dir, 'repo.csv')
+    make_csv(csv_path, n)
+    repo = dcm_repo.RepoManager('bench', csv_path, tmp_dir)
+    repo.open()
+    repo.close()
+
+    for name in ['close (1 change)', 'close (no change)']:
+      repo = dcm_repo.RepoManager('bench', csv_path, tmp_dir)
+      repo.open()
+      if name == 'close (1 change)': repo.change_title(1, 'new title')
+      repo.html_generation = repo.generation
+      t0 = time.time()
+      repo.close()
+      report(name, n, time.time() - t0)
+
+#
+# benchmark: html index generation
+def bench_html(n):
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    csv_path = os.path.join(tmp_dir, 'repo.csv')
+    make_csv(csv_path, n)
+
+    repo = dcm_repo.RepoManager('bench', csv_path, tmp_dir)
+    repo.db_conn.execute('CREATE TABLE resource (' + repo.COLS_TYPE + ')')
+    repo._import_csv()
+    for mode in [dcm_html.HTML_TABLE, dcm_html.HTML_VIRTUAL]:
+      t0 = time.time()
+      repo._save_html(os.path.join(tmp_dir, 'index.html'), '', '', mode)
+      report('html index (' + mode + ')', n, time.time() - t0)
+    repo.db_conn.close()
+
+#
+# benchmark: scan diff between directory files and DB entries (synthetic names, 1% new and 1% missing)
+def bench_scan(n):
+  sizes = [n] if n > 0 else [10000, 100000, 1000000]
+  for n in sizes:
+    filenames = ['file_%d.pdf' % i for i in range(n)]
+    db_values = [('file_%d.pdf' % i, i + 1) for i in range(n // 100, n + n // 100)]
+    random.shuffle(filenames)
+
+    t0 = time.time()
+    issues = dcm_scan.diff_files(filenames, db_values)
+    report('scan diff (' + str(len(issues)) + ' issues)', n, time.time() - t0, 'files')
+
+#
+# benchmark: label filter (first one builds the labels index) and label rename
+def bench_labels(n):
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    csv_path = os.path.join(tmp_dir, 'repo.csv')
+    make_csv(csv_path, n)
+
+    repo = dcm_repo.RepoManager('bench', csv_path, tmp_dir)
+    repo.open()
+    for name in ['label filter (index build)', 'label filter']:
+      t0 = time.time()
+      repo.set_andor_filter(True, False, '', '', '', '', 'lab7', '', True)
+      report(name + ', ' + str(len(repo.filtered)) + ' found', n, time.time() - t0)
+
+    t0 = time.time()
+    repo.rename_label_db('lab7', 'lab7b')
+    report('label rename', n, time.time() - t0)
+    repo.db_conn.close()
+
+#
+# benchmark: search of a missing string in a text file of n MB (the whole file is scanned)
+def bench_match(n):
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    filepath = os.path.join(tmp_dir, 'doc.txt')
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'Caffè', 'perché', 'SQLite', 'index', 'search']
+    line = (' '.join(random.choice(words) for i in range(12)) + '\n').encode('utf8')
+    block = (line * (1024 * 1024 // len(line) + 1))[:1024 * 1024]
+    with open(filepath, 'wb') as f:
+      for i in range(n):
+        f.write(block)
+
+    for s, case_insensitive in [('missing', False), ('missing', True), ('missing perché', True)]:
+      matcher = dcm_search.BytesMatcher(s.split(), case_insensitive)
+      for use_mmap in [True, False]:
+        name = 'match ' + repr(s) + (' ci' if case_insensitive else '') + (' (mmap)' if use_mmap and not matcher.fold else ' (chunks)')
+        t0 = time.time()
+        matcher.find_file(filepath, use_mmap)
+        report(name, n, time.time() - t0, 'MB')
+        if matcher.fold: break
+
+    # previous case insensitive matcher: text mode, one lower() per line
+    t0 = time.time()
+    with open(filepath, 'r', encoding='utf8') as file:
+      for line in file:
+        if 'missing' in line.lower(): break
+    report("match 'missing' ci (lines)", n, time.time() - t0, 'MB')
+
+BENCHMARKS = {
+  'open': (bench_open, 250000),
+  'close': (bench_close, 100000),
+  'html': (bench_html, 100000),
+  'scan': (bench_scan, 0),
+  'match': (bench_match, 256),
+  'labels': (bench_labels, 250000),
+}
+
+#
+# Main
+#
+if __name__ == '__main__':
+  if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+    print('usage: ' + sys.argv[0] + ' <' + '|'.join(BENCHMARKS) + '> [<size>]')
+    exit()
+
+  f, size = BENCHMARKS[sys.argv[1]]
+  if len(sys.argv) > 2: size = int(sys.argv[2])
+  f(size)
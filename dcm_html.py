@@ -0,0 +1,362 @@
+#
+# HTML index/export of repository entries (the file is written as a stream of chunks)
+#
+
+import re
+import html
+import json
+
+HTML_HEAD = '''
+<html>
+  <head>
+    <meta charset="utf-8">
+    <style>
+      <!--
+#myInput {
+    //background-image: url('/css/searchicon.png'); /* Add a search icon to input */
+    background-position: 10px 12px; /* Position the search icon */
+    background-repeat: no-repeat; /* Do not repeat the icon image */
+    width: 100%; /* Full-width */
+    font-size: 16px; /* Increase font-size */
+    padding: 12px 20px 12px 40px; /* Add some padding */
+    border: 1px solid #ddd; /* Add a grey border */
+    margin-bottom: 12px; /* Add some space below the input */
+}
+
+#myTable {
+    border-collapse: collapse; /* Collapse borders */
+    width: 100%; /* Full-width */
+    border: 1px solid #ddd; /* Add a grey border */
+    font-size: 14px; /* Increase font-size */
+}
+
+#myTable th, #myTable td {
+    text-align: left; /* Left-align text */
+    padding: 12px; /* Add padding */
+}
+
+#myTable tr {
+    /* Add a bottom border to all table rows */
+    border-bottom: 1px solid #ddd;
+}
+
+#myTable tr.header, #myTable tr:hover {
+    /* Add a grey background color to the table header and on hover */
+    background-color: #f1f1f1;
+}
+      -->
+    </style>
+
+    <script>
+      <!--
+function myFunction() {
+  var input, filter, table, tr, td, i;
+  input = document.getElementById("myInput");
+  filter = input.value.toUpperCase();
+  table = document.getElementById("myTable");
+  tr = table.getElementsByTagName("tr");
+
+  // Loop through all table rows, and hide those who don't match the search query
+  for (i = 0; i < tr.length; i++) 
+  {
+    // Loop through all table columns
+    found = false;
+
+    tds = tr[i].getElementsByTagName("td");
+    for (j = 0; j < tds.length; j++) 
+    {
+      td = tds[j]; 
+      if (!td) continue;
+      
+      if (td.innerHTML.toUpperCase().indexOf(filter) > -1)
+      {
+        found = true;
+        break;
+      }
+    }
+
+    if (found) tr[i].style.display = "";
+    else tr[i].style.display = "none";
+  }
+}
+      -->
+    </script>
+  </head>
+  <body>
+    <input type="text" id="myInput" onkeyup="myFunction()" placeholder="Search for names..">
+
+'''
+
+HTML_FOOT = '''
+
+  </body>
+</html>
+    '''
+
+HTML_TABLE_HEAD = '''      <table id="myTable">
+
+          <tr class="header">
+            <th>kind</th>
+            <th>title</th>
+            <th>date_start</th>
+            <th>author</th>
+            <th>lang</th>
+            <th>labels</th>
+            <th>favorite</th>
+          </tr>
+'''
+
+HTML_TABLE_FOOT = '''      </table>
+'''
+
+ROWS_PER_CHUNK = 500 # table rows joined in a single write
+
+# index modes
+HTML_TABLE = 'table'     # one <tr> per entry (exports)
+HTML_VIRTUAL = 'virtual' # rows embedded as json, token index and rendering of the visible rows only (large repos)
+
+VIRTUAL_ROW_HEIGHT = 30 # px
+
+HTML_VIRTUAL_HEAD = '''
+<html>
+  <head>
+    <meta charset="utf-8">
+    <style>
+      <!--
+#myInput {
+    background-position: 10px 12px; /* Position the search icon */
+    background-repeat: no-repeat; /* Do not repeat the icon image */
+    width: 100%; /* Full-width */
+    font-size: 16px; /* Increase font-size */
+    padding: 12px 20px 12px 40px; /* Add some padding */
+    border: 1px solid #ddd; /* Add a grey border */
+    margin-bottom: 12px; /* Add some space below the input */
+}
+
+#myView {
+    position: relative;
+    height: 80vh; /* only the rows inside the view are rendered */
+    overflow-y: auto;
+    border: 1px solid #ddd; /* Add a grey border */
+}
+
+#myHeader, #myTable {
+    border-collapse: collapse; /* Collapse borders */
+    table-layout: fixed; /* same column widths for header and rows */
+    width: 100%; /* Full-width */
+    font-size: 14px; /* Increase font-size */
+}
+
+#myTable {
+    position: absolute;
+    top: 0;
+}
+
+#myHeader th, #myTable td {
+    text-align: left; /* Left-align text */
+    padding: 0 12px;
+    height: %row_height%px; /* fixed row height */
+    white-space: nowrap;
+    overflow: hidden;
+    text-overflow: ellipsis;
+}
+
+#myTable tr {
+    /* Add a bottom border to all table rows */
+    border-bottom: 1px solid #ddd;
+}
+
+#myHeader, #myTable tr:hover {
+    /* Add a grey background color to the table header and on hover */
+    background-color: #f1f1f1;
+}
+      -->
+    </style>
+  </head>
+  <body>
+    <input type="text" id="myInput" onkeyup="myFunction()" placeholder="Search for names..">
+    <div id="myCount"></div>
+    <table id="myHeader">
+      %colgroup%
+      <tr><th>kind</th><th>title</th><th>date_start</th><th>author</th><th>lang</th><th>labels</th><th>favorite</th></tr>
+    </table>
+    <div id="myView" onscroll="render()">
+      <div id="mySpacer"></div>
+      <table id="myTable">
+        %colgroup%
+        <tbody></tbody>
+      </table>
+    </div>
+'''
+
+HTML_VIRTUAL_COLGROUP = '<colgroup><col style="width:7%"><col style="width:38%"><col style="width:10%"><col style="width:10%"><col style="width:6%"><col style="width:21%"><col style="width:8%"></colgroup>'
+
+HTML_VIRTUAL_SCRIPT = '''
+    <script>
+      <!--
+var ROW_H = %row_height%;
+var OVERSCAN = 10;
+var DATA = JSON.parse(document.getElementById("myData").textContent);   // [kind, href, title, date_start, author, lang, labels, favorite]
+var INDEX = JSON.parse(document.getElementById("myIndex").textContent); // {tokens: sorted tokens, rows: row indexes of each token (delta encoded)}
+var TOKENS = INDEX.tokens;
+var view = null; // indexes of the rows matching the search (null: all rows)
+
+function esc(s) {
+  return s.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+}
+
+// render only the rows inside the visible window
+function render() {
+  var box = document.getElementById("myView");
+  var n = (view === null) ? DATA.length : view.length;
+  document.getElementById("mySpacer").style.height = (n * ROW_H) + "px";
+  document.getElementById("myCount").textContent = n + " / " + DATA.length;
+
+  var first = Math.max(0, Math.floor(box.scrollTop / ROW_H) - OVERSCAN);
+  var last = Math.min(n, Math.ceil((box.scrollTop + box.clientHeight) / ROW_H) + OVERSCAN);
+  var rows = [];
+  for (var i = first; i < last; i++)
+  {
+    var r = DATA[(view === null) ? i : view[i]];
+    rows.push("<tr><td>" + esc(r[0]) + "</td><td><a href=\\"" + esc(r[1]) + "\\">" + esc(r[2]) + "</a></td><td>" + esc(r[3]) + "</td><td>" + esc(r[4]) + "</td><td>" + esc(r[5]) + "</td><td>" + esc(r[6]) + "</td><td>" + esc(r[7]) + "</td></tr>");
+  }
+  var table = document.getElementById("myTable");
+  table.style.top = (first * ROW_H) + "px";
+  table.tBodies[0].innerHTML = rows.join("");
+}
+
+// index of the first token not less than the word (binary search)
+function lowerBound(word) {
+  var lo = 0, hi = TOKENS.length;
+  while (lo < hi)
+  {
+    var mid = (lo + hi) >> 1;
+    if (TOKENS[mid] < word) lo = mid + 1; else hi = mid;
+  }
+  return lo;
+}
+
+// flags of the rows with a token starting with the word (the matching tokens are contiguous)
+function lookup(word) {
+  var found = new Uint8Array(DATA.length);
+  for (var t = lowerBound(word); t < TOKENS.length && TOKENS[t].lastIndexOf(word, 0) === 0; t++)
+  {
+    var rows = INDEX.rows[t];
+    for (var j = 0, r = 0; j < rows.length; j++) { r += rows[j]; found[r] = 1; }
+  }
+  return found;
+}
+
+// search: rows matching all the input words
+function myFunction() {
+  var words = document.getElementById("myInput").value.toLowerCase().match(/[\\p{L}\\p{N}_]+/gu);
+  if (!words) view = null;
+  else
+  {
+    var found = lookup(words[0]);
+    for (var w = 1; w < words.length; w++)
+    {
+      var found_w = lookup(words[w]);
+      for (var i = 0; i < found.length; i++) found[i] &= found_w[i];
+    }
+    view = [];
+    for (var i = 0; i < found.length; i++) if (found[i]) view.push(i);
+  }
+  document.getElementById("myView").scrollTop = 0;
+  render();
+}
+
+render();
+      -->
+    </script>
+'''
+
+#
+# convert a DB row (RepoManager.COLS_WRITE) to an HTML table row (href: row link)
+def row_to_html(row, href):
+  e = html.escape
+  return ('        <tr>\n'
+    '          <td>' + e(row[0]) + '</td>\n'
+    '          <td><a href="' + e(href) + '">' + e(row[2]) + '</a></td>\n'
+    '          <td>' + e(row[3]) + '</td>\n'
+    '          <td>' + e(row[4]) + '</td>\n'
+    '          <td>' + e(row[5]) + '</td>\n'
+    '          <td>' + e(row[6]) + '</td>\n'
+    # keywords: '          <td>' + e(row[7]) + '</td>\n'
+    '          <td>' + e(row[8]) + '</td>\n'
+    '        </tr>\n')
+
+#
+# HTML table page generator (rows: DB rows iterable, href_f :: row -> link)
+def iter_table_html(rows, href_f):
+  yield HTML_HEAD
+  yield HTML_TABLE_HEAD
+
+  chunk = []
+  for row in rows:
+    chunk.append(row_to_html(row, href_f(row)))
+    if len(chunk) >= ROWS_PER_CHUNK:
+      yield ''.join(chunk)
+      chunk = []
+  if chunk:
+    yield ''.join(chunk)
+
+  yield HTML_TABLE_FOOT
+  yield HTML_FOOT
+
+#
+# json for a <script> element ('<' escaped so that '</script>' can't appear)
+def _script_json(obj):
+  return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).replace('<', '\\u003c')
+
+#
+# HTML virtualized page generator (rows: DB rows iterable, href_f :: row -> link)
+def iter_virtual_html(rows, href_f):
+  yield HTML_VIRTUAL_HEAD.replace('%row_height%', str(VIRTUAL_ROW_HEIGHT)).replace('%colgroup%', HTML_VIRTUAL_COLGROUP)
+
+  # rows data (streamed) while the token index is built (the link is not indexed)
+  index = {} # token -> row indexes
+  find_tokens = re.compile(r'\w+').findall
+  chunk = []
+  sep = ''
+  yield '    <script id="myData" type="application/json">['
+  for i, row in enumerate(rows):
+    values = [row[0], href_f(row), row[2], row[3], row[4], row[5], row[6], row[8]]
+    for token in set(find_tokens(' '.join(values[:1] + values[2:]).lower())):
+      postings = index.get(token)
+      if postings is None: index[token] = [i]
+      else: postings.append(i)
+
+    chunk.append(values)
+    if len(chunk) >= ROWS_PER_CHUNK:
+      yield sep + _script_json(chunk)[1:-1]
+      sep = ','
+      chunk = []
+  if chunk:
+    yield sep + _script_json(chunk)[1:-1]
+  yield ']</script>\n'
+
+  # tokens sorted as javascript compares strings (utf-16 code units), for the prefix binary search of the page,
+  # and their row indexes delta encoded (shorter json)
+  tokens = sorted(index, key=lambda token: token.encode('utf-16-be'))
+  rows = []
+  for token in tokens:
+    postings = index[token]
+    rows.append(postings[:1] + [b - a for a, b in zip(postings, postings[1:])])
+  yield '    <script id="myIndex" type="application/json">' + _script_json({'tokens': tokens, 'rows': rows}) + '</script>\n'
+  yield HTML_VIRTUAL_SCRIPT.replace('%row_height%', str(VIRTUAL_ROW_HEIGHT))
+  yield HTML_FOOT
+
+#
+# HTML page generator of the given mode
+def iter_html(mode, rows, href_f):
+  if mode == HTML_VIRTUAL:
+    return iter_virtual_html(rows, href_f)
+  return iter_table_html(rows, href_f)
+
+#
+# write the chunks of an HTML generator to a file
+def write_html(filepath, chunks):
+  with open(filepath, 'w', encoding='utf-8') as f:
+    for chunk in chunks:
+      f.write(chunk)
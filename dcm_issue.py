@@ -4,18 +4,22 @@
 class RepoIssueKind:
   NEW = 'new'
   MISSING = 'missing'
+  DUPLICATE = 'duplicate'
 
 #
 # An issue of the repository
 class RepoIssue():
 
-  def __init__(self, kind, url, rowid):
+  def __init__(self, kind, url, rowid, other_url = ''):
     self.kind = kind
     self.url = url
     self.rowid = rowid
+    self.other_url = other_url # DUPLICATE: url of the file with the same content
     
   def __str__(self):
     if self.kind == RepoIssueKind.NEW:
       return self.url + ' -- NEW'
+    elif self.kind == RepoIssueKind.DUPLICATE:
+      return self.url + ' -- DUPLICATE of ' + self.other_url
     else:
       return self.url + ' -- MISSING'
@@ -4,7 +4,7 @@ import datetime
 import sqlite3
 import webbrowser
 import traceback
-import dcm_util, dcm_issue
+import dcm_util, dcm_issue, dcm_html, dcm_scan, dcm_search
 
 #
 # Repository kinds
@@ -18,22 +18,43 @@ class ResourceKind:
 class RepoManager:
   COLS_TYPE = 'kind TEXT, url TEXT, title TEXT, date_start TEXT, author TEXT, lang TEXT, labels TEXT, keywords TEXT, favorite TEXT'
   COLS_WRITE = 'kind, url, title, date_start, author, lang, labels, keywords, favorite'
+  COLS_SEARCH_TYPE = 'rank REAL, snippet TEXT' # in memory only: rank and text snippet of the last ranked search
   COLS_SHOW_ALL = 'kind, substr(url, 1, 30) as url30, substr(title, 1, 30) as title30, date_start, author, lang, labels, favorite, rowid'
   #COLS_DEF_SHOWN = 'kind, substr(title, 1, 30) as title30, date_start, labels, rowid'
   COLS_DEF_SHOWN = 'kind, substr(title, 1, 30) as title30, date_start, labels, substr(url, 1, 20) as url20, rowid'
   INTERNAL_HTML_INDEX_FILENAME = '!!!index.html' #MTB [15/02/2018]
 
+  CACHE_SUFFIX = '.db'                       # sqlite sidecar next to the csv file
+  CACHE_VERSION = '4'                        # bump when the sidecar schema changes
+
+  IGNORE_SUFFIX = '.ignore'                  # scan ignore list next to the csv file (one fnmatch pattern per line)
+
+  JOURNAL_SUFFIX = '.journal'                # mutation journal next to the csv file
+  JOURNAL_COMPACT_SIZE = 256 * 1024          # journal size (bytes) that triggers its compaction into the csv
+  JOURNAL_BASE = 'base'                      # journal header: hash of the csv the journal applies to
+  JOURNAL_ADD = 'add'                        # add;rowid;<COLS_WRITE values>
+  JOURNAL_SET = 'set'                        # set;rowid;column;value
+  JOURNAL_DEL = 'del'                        # del;rowid
+
   COL_WRITE_URL = 1
   COL_WRITE_LABELS = 6
+  COLS_COUNT = 9
 
-  def __init__(self, repo_user, repo_csv_path, repo_dir_path):
+  def __init__(self, repo_user, repo_csv_path, repo_dir_path, scan_ignore = None):
     self.repo_user = repo_user                 # user repository
     self.repo_csv_path = repo_csv_path         # csv file path
     self.repo_dir_path = repo_dir_path         # repository directory path 
+    self.repo_cache_path = repo_csv_path + self.CACHE_SUFFIX # sqlite sidecar path
+    self.repo_journal_path = repo_csv_path + self.JOURNAL_SUFFIX # mutation journal path
+    self.repo_ignore_path = repo_csv_path + self.IGNORE_SUFFIX # scan ignore list path
+    if scan_ignore is None:
+      scan_ignore = self._read_scan_ignore()
 
     self.issues = []                           # scan issues
     self.labels = []                           # repo labels
+    self.labels_indexed = False                # label/resource_label tables built (see _index_labels)
     self.filtered = []                         # filtered repo entries
+    self.search_hits = {}                      # rowid -> hit offsets of the last regex/whole word search
 
     self.where_clause = ''                     # active SQL where clause
     self.set_def_filter()
@@ -45,48 +66,77 @@ class RepoManager:
 
     # sqlite
     self.db_conn = sqlite3.connect(':memory:') #sqlite3.connect('a.db')
+    self.scanner = dcm_scan.RepoScanner(self.db_conn, repo_dir_path, scan_ignore)
+    self.watcher = None                        # live directory watcher (see watch_start)
+    self.text_index = dcm_search.TextIndex(self.db_conn, repo_dir_path) # documents full-text index
 
-  #
-  # open the csv file and convert it to a sqlite db
-  def open(self):
-    tableCreated = False
-    with open(self.repo_csv_path, newline='') as csvfile:
-      reader = csv.reader(csvfile, delimiter=';', quotechar='|')
-      for row in reader:
-        if not tableCreated:
-          self.db_conn.execute('CREATE TABLE resource (' + self.COLS_TYPE + ')')
-          tableCreated = True
-          continue
+    # journal
+    self.csv_key = ''                          # key of the csv file (see _csv_key)
+    self.journal_file = None
+    self.journal_writer = None
 
-        # column 'labels' needs to be ordered
-        ls = row[self.COL_WRITE_LABELS].split()
-        ls.sort()
-        row[self.COL_WRITE_LABELS] = ' '.join(ls)
+    # dirty tracking
+    self.generation = 0                        # bumped by every DB mutation
+    self.saved_generation = 0                  # generation persisted in csv/journal/sidecar
+    self.html_generation = 0                   # generation of the internal html index
+    self.exported = {}                         # (filepath, csvFlag) -> (generation, rowids) of the last export
 
-        sql = 'INSERT INTO resource VALUES (%s)' % dcm_util.quote_list_as_str(row)
-        self.db_conn.execute(sql)
-    self.db_conn.commit()
+  #
+  # open the repo: the sqlite sidecar is used when it matches the csv and journal files, otherwise 
+  # the csv is imported and the journal (left by a session that did not close) replayed.
+  # If the csv changed outside dcm after the journal was written, its records no longer apply:
+  # set_aside_journal(journal_path) is asked whether to set the journal aside (as .journal.last)
+  # and go on; False leaves csv and journal untouched and open() returns False
+  def open(self, set_aside_journal = None):
+    self.db_conn.execute('CREATE TABLE resource (' + self.COLS_TYPE + ', ' + self.COLS_SEARCH_TYPE + ')')
+    self._attach_cache()
+
+    self.csv_key = self._csv_key()
+    if self._get_cache_meta('csv_key') == self.csv_key and self._get_cache_meta('journal_key') == self._journal_key():
+      self.db_conn.execute('INSERT INTO main.resource (rowid, ' + self.COLS_WRITE + ') SELECT rowid, ' + self.COLS_WRITE + ' FROM cache.resource')
+      self.db_conn.commit()
+    else:
+      self._import_csv()
+      if not self._replay_journal(set_aside_journal):
+        return False
+      self._save_cache()
+      self.html_generation = -1 # csv changed outside dcm: the html index is outdated
     
     self.db_conn.execute('PRAGMA case_sensitive_like=ON;') # default case sensitive on!
 
     self._update_labels()
     self.update_filtered()
+    return True
 
   #
-  # convert the the sqlite db to csv and close it
+  # close the repo: the changes are already in the journal (and in the sidecar, see _journal), only the
+  # sidecar is bound to the journal; the journal is folded into the csv when it grows too much
   def close(self):
-    dcm_util.safe_copy(self.repo_csv_path, self.repo_csv_path + '.last')
+    self.watch_stop()
+    self._close_journal()
     
-    self.where_clause = ''
-    self.orderby_clause = ''
-    self._filter_save_csv(self.repo_csv_path)
+    if self.save_pending():
+      if os.path.getsize(self.repo_journal_path) > self.JOURNAL_COMPACT_SIZE:
+        self._compact_journal()
+      else:
+        self._set_cache_meta('journal_key', self._journal_key())
+        self.db_conn.commit()
+      self.saved_generation = self.generation
 
     #MTB [15/02/2018]
     #self._save_html(self.repo_html_path)
-    self._save_html(os.path.join(self.repo_dir_path, self.INTERNAL_HTML_INDEX_FILENAME))
+    html_path = os.path.join(self.repo_dir_path, self.INTERNAL_HTML_INDEX_FILENAME)
+    if self.html_generation != self.generation or not os.path.exists(html_path):
+      self._save_html(html_path, '', ' ORDER BY title', dcm_html.HTML_VIRTUAL)
+      self.html_generation = self.generation
 
     self.db_conn.close()
 
+  #
+  # True if there are changes not yet saved in csv/sidecar
+  def save_pending(self):
+    return self.generation != self.saved_generation
+
   #
   # Copy issues to filtered
   def copy_issues_to_filtered(self):
@@ -94,53 +144,141 @@ class RepoManager:
     self.filtered.extend(self.issues)
 
   #
-  # scan the repository directory for issues (new files, error...)
-  def scan(self):
+  # scan the repository directory for issues (new files, error...); files moved/renamed are recognized 
+  # by their content and their DB entry fixed (return the list of (old url, new url) fixed)
+  # (workers: stat/hash threads, progress :: (phase, done, total) -> None)
+  def scan(self, auto_fix = True, workers = dcm_scan.RepoScanner.DEF_WORKERS, progress = None):
+    with self.scanner.running(workers, progress):
+      return self._scan(auto_fix)
+
+  #
+  # scan body (see scan)
+  def _scan(self, auto_fix):
     del self.issues[:]
-    db_values = dcm_util.select_db(self.db_conn, 'SELECT url, rowid FROM resource WHERE kind <> ' + dcm_util.quote_str(ResourceKind.BOOKMARK))
-    db_fnames = [value[0] for value in db_values]
-    db_rowids = [value[1] for value in db_values]
-    for filename in dcm_util.find_all_files(self.repo_dir_path):
-      if filename == self.INTERNAL_HTML_INDEX_FILENAME: # MTB [15/02/2018]: spostato il file di index internamente
-        continue
-      
-      if not (filename in db_fnames):
-        #filepath = os.path.join(self.repo_dir_path, filename)
-        issue = dcm_issue.RepoIssue(dcm_issue.RepoIssueKind.NEW, filename, -1)
-        self.issues.append(issue)
-      else:
-        i = db_fnames.index(filename)
-        db_fnames.pop(i)
-        db_rowids.pop(i)
+    db_values = dcm_util.select_db(self.db_conn, 'SELECT url, rowid FROM resource WHERE kind <> ' + dcm_util.quote_str(ResourceKind.BOOKMARK) + ' ORDER BY rowid')
+    filenames = self.scanner.list_files()
+    # MTB [15/02/2018]: spostato il file di index internamente
+    issues = dcm_scan.diff_files(filenames, db_values, (self.INTERNAL_HTML_INDEX_FILENAME,))
+
+    # content fingerprints of the DB files (kept to recognize them once moved) and of the new ones, only
+    # when the moved files are fixed
+    db_urls = set(value[0] for value in db_values)
+    new_urls = [issue.url for issue in issues if issue.kind == dcm_issue.RepoIssueKind.NEW]
+    missing_urls = [issue.url for issue in issues if issue.kind == dcm_issue.RepoIssueKind.MISSING]
+    moved = []
+    if auto_fix:
+      fingerprints = self.scanner.get_fingerprints([url for url in filenames if url in db_urls])
+    if auto_fix and len(new_urls) > 0 and len(missing_urls) > 0:
+      fingerprints.update(self.scanner.get_fingerprints(new_urls))
+      fingerprints.update(self.scanner.get_cached_fingerprints(missing_urls))
+      moved = dcm_scan.find_moved(issues, fingerprints)
+      fixed = set() # issues fixed
+      with self.db_conn:
+        for issue_missing, issue_new in moved:
+          self._update_entry_db(issue_missing.rowid, 'url', issue_new.url)
+          db_urls.discard(issue_missing.url)
+          db_urls.add(issue_new.url)
+          fixed.update((issue_missing, issue_new))
+        self.text_index.rename_all([(issue_missing.url, issue_new.url) for issue_missing, issue_new in moved])
+      if len(moved) > 0:
+        issues = [issue for issue in issues if issue not in fixed]
+        self.update_filtered()
+    self.scanner.prune_fingerprints(db_urls)
+    self.text_index.prune(db_urls)
+
+    self.issues.extend(issues)
+    return [(issue_missing.url, issue_new.url) for issue_missing, issue_new in moved]
 
-    for i,filename in enumerate(db_fnames):
-      issue = dcm_issue.RepoIssue(dcm_issue.RepoIssueKind.MISSING, filename, db_rowids[i])
-      self.issues.append(issue)
+  #
+  # find the files with the same content (DB and new files, ignored ones excluded): the DUPLICATE issues
+  # replace the previous ones in self.issues and are returned
+  def find_duplicates(self, workers = dcm_scan.RepoScanner.DEF_WORKERS, progress = None):
+    with self.scanner.running(workers, progress):
+      filenames = self.scanner.list_files()
+      db_rowids = {}
+      ignored = set([self.INTERNAL_HTML_INDEX_FILENAME])
+      for kind, url, rowid in dcm_util.select_db(self.db_conn, 'SELECT kind, url, rowid FROM resource WHERE kind <> ' + dcm_util.quote_str(ResourceKind.BOOKMARK) + ' ORDER BY rowid'):
+        if kind == ResourceKind.IGNORE: ignored.add(url)
+        else: db_rowids.setdefault(url, rowid)
+      groups = self.scanner.find_duplicates([url for url in filenames if url not in ignored])
+
+    dups = []
+    for group in groups:
+      # the DB entry (if any) is the original, the other files are its duplicates
+      group.sort(key=lambda url: (url not in db_rowids, url))
+      for url in group[1:]:
+        dups.append(dcm_issue.RepoIssue(dcm_issue.RepoIssueKind.DUPLICATE, url, db_rowids.get(url, -1), group[0]))
+
+    self.issues[:] = [issue for issue in self.issues if issue.kind != dcm_issue.RepoIssueKind.DUPLICATE] + dups
+    return dups
 
   #
-  # export elements to csv/html
-  def export_to_csv_html(self, rowids, filepath, csvFlag):
-    old_where_clause = self.where_clause
+  # start watching the repository directory: self.issues is kept up to date by apply_watch_events
+  def watch_start(self, poll_interval = 2.0):
+    if self.watcher is not None: return
+    self.watcher = dcm_scan.make_watcher(self.repo_dir_path, self.scanner.is_ignored, poll_interval)
+    self.watcher.start()
 
-    self.set_def_filter()
-    self.where_clause = self.where_clause + ' AND (1 = 0'
-    for r in rowids:
-      self.where_clause = self.where_clause + ' OR rowid = ' + str(r)
-    self.where_clause = self.where_clause + ')'
+  #
+  # stop watching the repository directory
+  def watch_stop(self):
+    if self.watcher is None: return
+    self.watcher.stop()
+    self.watcher = None
 
+  #
+  # True if the repository directory is watched
+  def is_watching(self):
+    return self.watcher is not None
+
+  #
+  # update the issues with the watcher events collected by its thread (the DB is only used by this thread);
+  # return the number of events applied
+  def apply_watch_events(self):
+    if self.watcher is None: return 0
+
+    events = self.watcher.get_events()
+    if any(kind == dcm_scan.WatchEvent.RESCAN for kind, url in events):
+      self.scan()
+      return len(events)
+
+    for kind, url in events:
+      if kind == dcm_scan.WatchEvent.CREATED:
+        self._watch_created(url)
+      elif kind == dcm_scan.WatchEvent.DELETED:
+        self._watch_deleted(url)
+      elif kind == dcm_scan.WatchEvent.DELETED_DIR:
+        prefix = url + '/'
+        urls = [issue.url for issue in self.issues if issue.kind == dcm_issue.RepoIssueKind.NEW and issue.url.startswith(prefix)]
+        urls.extend(dcm_util.select1c_db(self.db_conn, 'SELECT DISTINCT url FROM resource WHERE kind <> ' + dcm_util.quote_str(ResourceKind.BOOKMARK) + ' AND substr(url, 1, ' + str(len(prefix)) + ') = ' + dcm_util.quote_str(prefix)))
+        for u in urls:
+          self._watch_deleted(u)
+    return len(events)
+
+  #
+  # export elements to csv/html (return False if the file was already exported with the same content)
+  def export_to_csv_html(self, rowids, filepath, csvFlag):
+    export_key = (os.path.abspath(filepath), csvFlag)
+    export_value = (self.generation, tuple(rowids))
+    if self.exported.get(export_key) == export_value and os.path.exists(filepath):
+      return False
+
+    # the active filter is left untouched
+    where_clause = self.get_def_filter() + ' AND rowid IN (' + ', '.join([str(r) for r in rowids]) + ')'
     if csvFlag:
-      self._filter_save_csv(filepath)
+      self._filter_save_csv(filepath, where_clause, ' ORDER BY title')
     else:
-      self._save_html(filepath)
+      self._save_html(filepath, where_clause, ' ORDER BY title')
     
-    self.where_clause = old_where_clause
-    self.update_filtered(self.active_sql_cols)
+    self.exported[export_key] = export_value
+    return True
 
   #
   # Add document to DB
   def add_doc_db(self, repo_issue, title, lang, labels, keywords):
     if repo_issue.kind != dcm_issue.RepoIssueKind.NEW: return False
     self._add_entry_db(ResourceKind.DOC, repo_issue.url, title, lang, labels, keywords, '')
+    if self.text_index.available: self.text_index.update([repo_issue.url])
     self.update_filtered()
     return True
 
@@ -175,8 +313,9 @@ class RepoManager:
     if not issue_missing or not issue_new:
       return False
 
-    self.db_conn.execute('UPDATE resource SET url = ' + dcm_util.quote_str(issue_new.url) + ' WHERE rowid = ' + str(issue_missing.rowid))
+    self._update_entry_db(issue_missing.rowid, 'url', issue_new.url)
     self.db_conn.commit()
+    self.text_index.rename(issue_missing.url, issue_new.url)
     self.update_filtered()
     return True
 
@@ -184,8 +323,10 @@ class RepoManager:
   # Remove missing entry from DB
   def remove_missing_entry_db(self, repo_issue):
     if repo_issue.kind != dcm_issue.RepoIssueKind.MISSING: return False
-    self.db_conn.execute('DELETE FROM resource WHERE url = ' + dcm_util.quote_str(repo_issue.url))
+    for rowid in dcm_util.select1c_db(self.db_conn, 'SELECT rowid FROM resource WHERE url = ' + dcm_util.quote_str(repo_issue.url)):
+      self._delete_entry_db(rowid)
     self.db_conn.commit()
+    self.text_index.remove(repo_issue.url)
     self.update_filtered()
     return True
 
@@ -196,8 +337,9 @@ class RepoManager:
     row = rows[0]
     if row[0] == ResourceKind.DOC:
       os.remove(os.path.join(self.repo_dir_path, row[1]))
+      self.text_index.remove(row[1])
 
-    self.db_conn.execute('DELETE FROM resource WHERE rowid = ' + str(rowid))
+    self._delete_entry_db(rowid)
     self.db_conn.commit()
     self.update_filtered()
     return True
@@ -221,7 +363,12 @@ class RepoManager:
   #
   # set default filter where clause
   def set_def_filter(self):
-    self.where_clause = ' WHERE (kind <> ' + dcm_util.quote_str(ResourceKind.IGNORE) + ') '
+    self.where_clause = self.get_def_filter()
+
+  #
+  # get default filter where clause
+  def get_def_filter(self):
+    return ' WHERE (kind <> ' + dcm_util.quote_str(ResourceKind.IGNORE) + ') '
 
   #
   # set AND|OR filter where clause
@@ -245,7 +392,7 @@ class RepoManager:
       self.where_clause = self.where_clause + dcm_util.get_sql_andor_quoted(case_sensitive, 'lang', lang, andFlag)
     
     if andFlag or labels != '':
-      self.where_clause = self.where_clause + dcm_util.get_sql_andor_quoted(case_sensitive, 'labels', labels, andFlag)
+      self.where_clause = self.where_clause + self._get_sql_labels_filter(case_sensitive, labels, andFlag)
     
     if andFlag or keywords != '':
       self.where_clause = self.where_clause + dcm_util.get_sql_andor_quoted(case_sensitive, 'keywords', keywords, andFlag)
@@ -289,8 +436,9 @@ class RepoManager:
       ls = [l.strip() for l in ls if l != label]
     else:
       ls.append(label.strip())
+      ls.sort()
       res = True
-    self.db_conn.execute('UPDATE resource SET labels = ' + dcm_util.quote_str(' '.join(ls)) + ' WHERE rowid = ' + str(rowid))
+    self._update_entry_db(rowid, 'labels', ' '.join(ls))
     self.db_conn.commit()
 
     self._update_labels()
@@ -309,7 +457,7 @@ class RepoManager:
     else:
       row_favorite = ''
 
-    self.db_conn.execute('UPDATE resource SET favorite = ' + dcm_util.quote_str(row_favorite) + ' WHERE rowid = ' + str(rowid))
+    self._update_entry_db(rowid, 'favorite', row_favorite)
     self.db_conn.commit()
 
     self.update_filtered()
@@ -352,7 +500,7 @@ class RepoManager:
   #
   # get item url
   def change_title(self, rowid, title):
-    self.db_conn.execute('UPDATE resource SET title = ' + dcm_util.quote_str(title) + ' WHERE rowid = ' + str(rowid))
+    self._update_entry_db(rowid, 'title', title)
     self.db_conn.commit()
 
     self.update_filtered()
@@ -381,20 +529,175 @@ class RepoManager:
     print()
 
   #
-  # search a string (s) inside the currently filtered documents
-  def search_string(self, s, case_insesitve):
-    to_be_removed = []
-    for row in self.filtered:
-      rowid = self.get_rowid(row)
-      url = self.get_url(rowid)
-      kind = self.get_kind(rowid)
+  # search a query (s, see dcm_search.Query: terms, "phrases", AND, OR, NOT) inside the currently filtered
+  # documents and keep only the matching ones in the filtered list (see iter_search). Raise ValueError if the
+  # query is invalid. Return False if interrupted (Ctrl-C): the filtered list keeps the matches found so far
+  def search_string(self, s, case_insesitve, workers = dcm_search.DEF_WORKERS):
+    found = set()
+    complete = True
+    try:
+      for rowid, url in self.iter_search(s, case_insesitve, workers):
+        found.add(rowid)
+    except KeyboardInterrupt:
+      complete = False
+    self.keep_filtered(found)
+    return complete
 
-      to_be_removed.append(row)
-      if self.get_kind(rowid) == ResourceKind.DOC and dcm_util.search_string_in_file(url, s, case_insesitve):
-        to_be_removed.remove(row)
-    
-    for row in to_be_removed:
-      self.filtered.remove(row)
+  #
+  # iterator of the (rowid, url) of the filtered documents matching the query (s), as they are found: the
+  # documents already in the full-text index come first (one index query), then the others are indexed with their
+  # text extracted by workers threads and matched (all the query terms with a single pass over the text); the ones
+  # without a text to cache (binary or too long, see dcm_search.extract_text) are searched in place.
+  # Without FTS5 the files are searched in place (dcm_search.BytesMatcher), the pdfs in their (cached) text.
+  # Raise ValueError if the query is invalid
+  def iter_search(self, s, case_insesitve, workers = dcm_search.DEF_WORKERS):
+    return self._iter_search(dcm_search.Query(s), case_insesitve, workers)
+
+  def _iter_search(self, query, case_insesitve, workers):
+    rowids = dict((url, rowid) for rowid, url in self._select_filtered_docs())
+    bytes_matcher = dcm_search.BytesMatcher(query.terms, case_insesitve)
+    if self.text_index.available:
+      items, fresh = self.text_index.stale(rowids)
+      for url in self.text_index.search_query(query, not case_insesitve, fresh):
+        yield rowids[url], url
+    else:
+      items = []
+      files = []
+      for url in rowids:
+        if os.path.splitext(url)[1].lower() != dcm_search.PDF_EXT:
+          files.append(url)
+          continue
+        try:
+          items.append((url, os.stat(os.path.join(self.repo_dir_path, url))))
+        except OSError:
+          continue
+      for url, found in dcm_search.iter_map(lambda url, cancel: bytes_matcher.find_file(os.path.join(self.repo_dir_path, url)), files, workers):
+        if query.match(found):
+          yield rowids[url], url
+
+    matcher = dcm_search.MultiMatcher(query.terms, case_insesitve)
+    in_place = [] # documents without a cached text
+    try:
+      for url, st, text in self.text_index.text_cache.iter_texts(items, workers):
+        if text is None:
+          in_place.append(url)
+        elif query.match(matcher.find(text)):
+          yield rowids[url], url
+    finally:
+      self.text_index.text_cache.evict()
+
+    for url, found in dcm_search.iter_map(lambda url, cancel: dcm_search.find_terms(os.path.join(self.repo_dir_path, url), bytes_matcher, cancel), in_place, workers):
+      if query.match(found):
+        yield rowids[url], url
+
+  #
+  # ranked search: the filtered documents are searched for the query (see search_string), then the matching
+  # ones are ranked by the BM25 score of their text (FTS5 index) plus RANK_BOOSTS for each query term found in
+  # their title, labels and keywords, and the filtered list is sorted by rank. The rank and a snippet of the text
+  # are stored in the rank/snippet columns and the where clause is narrowed to the ranked rows, so the filtered list
+  # can be queried again (e.g. 'ORDER BY rank DESC'). Return the (rowid, rank, snippet) list sorted by rank and
+  # False if the search was interrupted (see search_string)
+  def search_ranked(self, s, case_insesitve, workers = dcm_search.DEF_WORKERS):
+    query = dcm_search.Query(s)
+    complete = self.search_string(s, case_insesitve, workers)
+
+    docs = self._select_filtered_docs()
+    ranks = self.text_index.rank(query.positive_terms, set(url for rowid, url in docs)) if self.text_index.available else {}
+    terms = [term.lower() for term in query.positive_terms]
+    cols = ', '.join('r.' + col for col, boost in dcm_search.RANK_BOOSTS)
+    urls = dict(docs)
+    res = []
+    for row in self.db_conn.execute('SELECT r.rowid, ' + cols + ' FROM resource r JOIN temp.filtered_rowid f ON f.rowid = r.rowid WHERE r.kind = ?', (ResourceKind.DOC,)):
+      score, snippet = ranks.get(urls[row[0]], (0.0, ''))
+      for value, (col, boost) in zip(row[1:], dcm_search.RANK_BOOSTS):
+        value = (value or '').lower()
+        score += boost * sum(1 for term in terms if term in value)
+      res.append((row[0], score, snippet))
+    res.sort(key=lambda x: x[1], reverse=True)
+
+    with self.db_conn:
+      self.db_conn.execute('UPDATE resource SET rank = NULL, snippet = NULL WHERE rank IS NOT NULL')
+      self.db_conn.executemany('UPDATE resource SET rank = ?, snippet = ? WHERE rowid = ?', [(score, snippet, rowid) for rowid, score, snippet in res])
+    self.where_clause = self.where_clause + ' AND rank IS NOT NULL'
+
+    order = dict((rowid, i) for i, (rowid, score, snippet) in enumerate(res))
+    self.filtered.sort(key=lambda row: order.get(self.get_rowid(row), len(order)))
+    return res, complete
+
+  #
+  # search a regex (or the string s, is_regex False), optionally as whole word, inside the currently filtered
+  # documents and keep only the matching ones in the filtered list (see iter_search_regex). Raise ValueError if
+  # the regex is invalid. Return False if interrupted (Ctrl-C): the filtered list keeps the matches found so far
+  def search_regex(self, s, case_insesitve, whole_word = False, is_regex = True, max_hits = dcm_search.DEF_MAX_HITS, workers = dcm_search.DEF_WORKERS):
+    complete = True
+    try:
+      for match in self.iter_search_regex(s, case_insesitve, whole_word, is_regex, max_hits, workers):
+        pass
+    except KeyboardInterrupt:
+      complete = False
+    self.keep_filtered(self.search_hits)
+    return complete
+
+  #
+  # iterator of the (rowid, url, hit offsets) of the filtered documents matching the regex (see search_regex), as
+  # they are found: the files are searched in place, pdfs in their (cached) extracted text, streamed from the extractor
+  # if too long to be cached. The offsets of the first max_hits matches of each document are also kept in search_hits.
+  # Raise ValueError if the regex is invalid
+  def iter_search_regex(self, s, case_insesitve, whole_word = False, is_regex = True, max_hits = dcm_search.DEF_MAX_HITS, workers = dcm_search.DEF_WORKERS):
+    self.search_hits = {}
+    return self._iter_search_regex(dcm_search.RegexMatcher(s, case_insesitve, whole_word, is_regex, max_hits), workers)
+
+  def _iter_search_regex(self, matcher, workers):
+    rowids = {} # url -> rowid
+    pdfs = []
+    files = []
+    for rowid, url in self._select_filtered_docs():
+      rowids[url] = rowid
+      if os.path.splitext(url)[1].lower() != dcm_search.PDF_EXT:
+        files.append(url)
+        continue
+      try:
+        pdfs.append((url, os.stat(os.path.join(self.repo_dir_path, url))))
+      except OSError:
+        continue
+
+    for url, hits in dcm_search.iter_map(lambda url, cancel: matcher.search_file(os.path.join(self.repo_dir_path, url)), files, workers):
+      if hits:
+        self.search_hits[rowids[url]] = hits
+        yield rowids[url], url, hits
+
+    in_place = [] # pdfs whose text is too long to be cached
+    try:
+      for url, st, text in self.text_index.text_cache.iter_texts(pdfs, workers):
+        if text is None:
+          in_place.append(url)
+          continue
+        hits = matcher.search_text(text)
+        if hits:
+          self.search_hits[rowids[url]] = hits
+          yield rowids[url], url, hits
+    finally:
+      self.text_index.text_cache.evict()
+
+    for url, hits in dcm_search.iter_map(lambda url, cancel: matcher.search_pdf(os.path.join(self.repo_dir_path, url), cancel), in_place, workers):
+      if hits:
+        self.search_hits[rowids[url]] = hits
+        yield rowids[url], url, hits
+
+  #
+  # (rowid, url) of the documents in the filtered list, with a single query (the other kinds are skipped)
+  def _select_filtered_docs(self):
+    self.db_conn.execute('CREATE TEMP TABLE IF NOT EXISTS filtered_rowid (rowid INTEGER PRIMARY KEY)')
+    self.db_conn.execute('DELETE FROM temp.filtered_rowid')
+    self.db_conn.executemany('INSERT OR IGNORE INTO temp.filtered_rowid VALUES (?)', [(self.get_rowid(row),) for row in self.filtered])
+    rows = self.db_conn.execute('SELECT r.rowid, r.url FROM resource r JOIN temp.filtered_rowid f ON f.rowid = r.rowid WHERE r.kind = ?', (ResourceKind.DOC,)).fetchall()
+    self.db_conn.commit()
+    return rows
+
+  #
+  # keep in the filtered list (in its order) only the rows in the rowids set
+  def keep_filtered(self, rowids):
+    self.filtered[:] = [row for row in self.filtered if self.get_rowid(row) in rowids]
 
   #
   # -------------  PRIVATE
@@ -414,176 +717,326 @@ class RepoManager:
       return res
 
   #
-  # save filtered data to csv
-  def _filter_save_csv(self, filepath):
-    self.update_filtered(self.COLS_WRITE)
+  # iterate the DB rows of a query in batches (the filtered list is not touched)
+  def _iter_db_rows(self, cols, where_clause, orderby_clause, batch_size = 1000):
+    cur = self.db_conn.cursor()
+    cur.execute('SELECT ' + cols + ' FROM resource' + where_clause + orderby_clause)
+    while True:
+      rows = cur.fetchmany(batch_size)
+      if not rows: break
+      yield from rows
+
+  #
+  # save filtered data to csv (streamed from the DB)
+  def _filter_save_csv(self, filepath, where_clause, orderby_clause):
     with open(filepath, 'w', newline='') as csvfile:
       spamwriter = csv.writer(csvfile, delimiter=';', quotechar='|', quoting=csv.QUOTE_MINIMAL)
       spamwriter.writerow(self.COLS_WRITE.split(', '))
-      for row in self.filtered:
-        spamwriter.writerow(row)
+      spamwriter.writerows(self._iter_db_rows(self.COLS_WRITE, where_clause, orderby_clause))
+
+  #
+  # import the csv file into the resource table (one transaction, bound parameters)
+  def _import_csv(self):
+    sql = 'INSERT INTO resource (' + self.COLS_WRITE + ') VALUES (' + ', '.join(['?'] * self.COLS_COUNT) + ')'
+    with open(self.repo_csv_path, newline='') as csvfile:
+      with self.db_conn:
+        self.db_conn.executemany(sql, self._iter_csv_rows(csvfile))
+
+  #
+  # csv rows generator (header skipped, 'labels' column normalized)
+  def _iter_csv_rows(self, csvfile):
+    reader = csv.reader(csvfile, delimiter=';', quotechar='|')
+    next(reader, None) # header
+
+    # column 'labels' needs to be ordered: the same label strings repeat a lot, so they are sorted once
+    sorted_labels = {}
+    for row in reader:
+      labels = row[self.COL_WRITE_LABELS]
+      ls = sorted_labels.get(labels)
+      if ls is None:
+        ls = sorted_labels[labels] = ' '.join(sorted(labels.split()))
+      row[self.COL_WRITE_LABELS] = ls
+      yield row
+
+  #
+  # attach the sqlite sidecar (schema 'cache'), recreating it if its version is outdated
+  def _attach_cache(self):
+    self.db_conn.execute('ATTACH DATABASE ? AS cache', (self.repo_cache_path,))
+    self.db_conn.execute('CREATE TABLE IF NOT EXISTS cache.meta (name TEXT PRIMARY KEY, value TEXT)')
+    if self._get_cache_meta('version') != self.CACHE_VERSION:
+      # virtual tables first, they drop their own shadow tables
+      for kind, name in self.db_conn.execute("SELECT type, name FROM cache.sqlite_master WHERE type IN ('table', 'view') AND name <> 'meta' ORDER BY sql LIKE 'CREATE VIRTUAL%' DESC").fetchall():
+        self.db_conn.execute('DROP ' + kind.upper() + ' IF EXISTS cache.' + name)
+      self.db_conn.execute('DELETE FROM cache.meta')
+      self._set_cache_meta('version', self.CACHE_VERSION)
+    self.db_conn.execute('CREATE TABLE IF NOT EXISTS cache.resource (' + self.COLS_TYPE + ')')
+    self.scanner.create_tables()
+    self.text_index.create_tables()
+    # the snapshot doesn't list the ignored entries: it is outdated when the ignore list changes
+    scan_ignore = '\n'.join(self.scanner.ignore)
+    if self._get_cache_meta('scan_ignore') != scan_ignore:
+      self.scanner.reset_snapshot()
+      self._set_cache_meta('scan_ignore', scan_ignore)
+    self.db_conn.commit()
+
+  #
+  # read the scan ignore list stored with the repo (None if there is none: default list)
+  def _read_scan_ignore(self):
+    if not os.path.exists(self.repo_ignore_path):
+      return None
+    with open(self.repo_ignore_path, encoding='utf-8') as file:
+      lines = [line.strip() for line in file]
+    return [line for line in lines if line != '' and not line.startswith('#')]
+
+  #
+  # get a value from the sidecar meta table ('' if missing)
+  def _get_cache_meta(self, name):
+    rows = dcm_util.select1c_db(self.db_conn, 'SELECT value FROM cache.meta WHERE name = ' + dcm_util.quote_str(name))
+    return rows[0] if len(rows) > 0 else ''
+
+  #
+  # set a value in the sidecar meta table
+  def _set_cache_meta(self, name, value):
+    self.db_conn.execute('INSERT OR REPLACE INTO cache.meta VALUES (' + dcm_util.quote_list_as_str([name, value]) + ')')
+
+  #
+  # key identifying the current csv file content (size, mtime and hash)
+  def _csv_key(self):
+    st = os.stat(self.repo_csv_path)
+    return '%d:%d:%s' % (st.st_size, st.st_mtime_ns, dcm_util.file_hash(self.repo_csv_path))
+
+  #
+  # key identifying the current journal file ('' if there is no journal)
+  def _journal_key(self):
+    if not os.path.exists(self.repo_journal_path):
+      return ''
+    st = os.stat(self.repo_journal_path)
+    return '%d:%d' % (st.st_size, st.st_mtime_ns)
+
+  #
+  # copy the resource table into the sidecar and bind it to the csv/journal keys
+  # (renumber: rowids are reassigned as a fresh import of the csv would do)
+  def _save_cache(self, renumber = False):
+    self.db_conn.execute('DELETE FROM cache.resource')
+    if renumber:
+      self.db_conn.execute('INSERT INTO cache.resource (' + self.COLS_WRITE + ') SELECT ' + self.COLS_WRITE + ' FROM main.resource ORDER BY rowid')
+    else:
+      self.db_conn.execute('INSERT INTO cache.resource (rowid, ' + self.COLS_WRITE + ') SELECT rowid, ' + self.COLS_WRITE + ' FROM main.resource')
+    self._set_cache_meta('csv_key', self.csv_key)
+    self._set_cache_meta('journal_key', self._journal_key())
+    self.db_conn.commit()
+
+  #
+  # append a mutation to the journal (the file is kept open for the whole session) and apply it to the
+  # sidecar copy of the resource table, so that close() doesn't copy the whole table
+  def _journal(self, op, rowid, values):
+    if self.journal_file is None:
+      newFlag = not os.path.exists(self.repo_journal_path) or os.path.getsize(self.repo_journal_path) == 0
+      self.journal_file = open(self.repo_journal_path, 'a', newline='')
+      self.journal_writer = csv.writer(self.journal_file, delimiter=';', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+      if newFlag:
+        self.journal_writer.writerow([self.JOURNAL_BASE, self.csv_key.split(':')[-1]])
+
+    self.journal_writer.writerow([op, rowid] + list(values))
+    self.journal_file.flush()
+    self._apply_journal_record('cache.resource', [op, rowid] + list(values))
+    self.generation += 1
+
+  #
+  # close the journal file
+  def _close_journal(self):
+    if self.journal_file is None: return
+    self.journal_file.close()
+    self.journal_file = None
+    self.journal_writer = None
+
+  #
+  # apply the journal mutations to the resource table. A journal whose base csv changed outside dcm
+  # is set aside only if set_aside_journal (see open) agrees, otherwise False is returned
+  def _replay_journal(self, set_aside_journal = None):
+    if not os.path.exists(self.repo_journal_path): return True
+
+    with open(self.repo_journal_path, newline='') as journalfile:
+      reader = csv.reader(journalfile, delimiter=';', quotechar='|')
+      header = next(reader, None)
+      if header is None or len(header) < 2 or header[1] != self.csv_key.split(':')[-1]:
+        journalfile.close()
+        if set_aside_journal is not None and not set_aside_journal(self.repo_journal_path):
+          return False
+        os.replace(self.repo_journal_path, self.repo_journal_path + '.last')
+        print('the csv file changed outside dcm, journal ignored (saved as ' + self.repo_journal_path + '.last)')
+        return True
+
+      with self.db_conn:
+        for row in reader:
+          if len(row) < 2: continue # truncated line
+          self._apply_journal_record('main.resource', row)
+    return True
+
+  #
+  # apply a journal record (op, rowid, values) to a resource table (main or sidecar)
+  def _apply_journal_record(self, table, row):
+    op = row[0]
+    rowid = int(row[1])
+    if op == self.JOURNAL_ADD and len(row) == self.COLS_COUNT + 2:
+      self.db_conn.execute('INSERT INTO ' + table + ' (rowid, ' + self.COLS_WRITE + ') VALUES (' + ', '.join(['?'] * (self.COLS_COUNT + 1)) + ')', [rowid] + row[2:])
+    elif op == self.JOURNAL_SET and len(row) == 4 and row[2] in self.COLS_WRITE.split(', '):
+      self.db_conn.execute('UPDATE ' + table + ' SET ' + row[2] + ' = ? WHERE rowid = ?', (row[3], rowid))
+    elif op == self.JOURNAL_DEL:
+      self.db_conn.execute('DELETE FROM ' + table + ' WHERE rowid = ?', (rowid,))
+
+  #
+  # fold the journal into the csv file
+  def _compact_journal(self):
+    dcm_util.safe_copy(self.repo_csv_path, self.repo_csv_path + '.last')
+
+    self._filter_save_csv(self.repo_csv_path, '', ' ORDER BY rowid') # same order (and rowids) of a new import
+
+    dcm_util.safe_remove(self.repo_journal_path)
+    self.csv_key = self._csv_key()
+    self._save_cache(True)
 
   #
   # update labels list
   def _update_labels(self):
-    rows = dcm_util.select1c_db(self.db_conn, 'SELECT DISTINCT(labels) FROM resource')
     del self.labels[:] #destroys the list not its pointer! ---> self.labels = []
+    if self.labels_indexed:
+      self.labels.extend(dcm_util.select1c_db(self.db_conn, 'SELECT name FROM label l WHERE EXISTS (SELECT 1 FROM resource_label rl WHERE rl.label_id = l.id) ORDER BY name'))
+      return
+
+    rows = dcm_util.select1c_db(self.db_conn, 'SELECT DISTINCT(labels) FROM resource')
     for ls in rows:
       for l in ls.split():
         if l in self.labels: continue
         self.labels.append(l)
     self.labels.sort()
 
+  #
+  # build the normalized labels tables from the 'labels' column (its serialized form): label (id, name) and
+  # resource_label (resource_id, label_id), indexed both ways, so a label query is an index lookup. They are
+  # built by the first label query (not at open) and then kept in sync by the DB entry functions
+  def _index_labels(self):
+    if self.labels_indexed: return
+    self.db_conn.execute('CREATE TABLE label (id INTEGER PRIMARY KEY, name TEXT UNIQUE)')
+    self.db_conn.execute('CREATE INDEX label_upper ON label (UPPER(name))')
+    self.db_conn.execute('CREATE TABLE resource_label (resource_id INTEGER, label_id INTEGER)')
+
+    # the same labels column values repeat a lot: each distinct value is split once, then the rows are joined
+    # with the (value, label id) pairs
+    self.db_conn.execute('CREATE TEMP TABLE labels_split (labels TEXT, label_id INTEGER)')
+    label_ids = {} # name -> id
+    pairs = []
+    for labels in dcm_util.select1c_db(self.db_conn, 'SELECT DISTINCT labels FROM resource'):
+      for l in set((labels or '').split()):
+        if l not in label_ids: label_ids[l] = self._get_label_id(l)
+        pairs.append((labels, label_ids[l]))
+    self.db_conn.executemany('INSERT INTO temp.labels_split VALUES (?, ?)', pairs)
+    self.db_conn.execute('CREATE INDEX temp.labels_split_labels ON labels_split (labels)')
+    self.db_conn.execute('INSERT INTO resource_label SELECT r.rowid, s.label_id FROM resource r JOIN temp.labels_split s ON s.labels = r.labels')
+    self.db_conn.execute('DROP TABLE temp.labels_split')
+    self.db_conn.execute('CREATE INDEX resource_label_label ON resource_label (label_id, resource_id)')
+    self.db_conn.execute('CREATE INDEX resource_label_resource ON resource_label (resource_id)')
+    self.db_conn.commit()
+    self.labels_indexed = True
+
+  #
+  # id of a label (added to the label table if missing)
+  def _get_label_id(self, name):
+    row = self.db_conn.execute('SELECT id FROM label WHERE name = ?', (name,)).fetchone()
+    if row is not None: return row[0]
+    return self.db_conn.execute('INSERT INTO label (name) VALUES (?)', (name,)).lastrowid
+
+  #
+  # set the labels (labels column value) of an entry in the resource_label table
+  def _set_resource_labels(self, rowid, labels):
+    if not self.labels_indexed: return
+    self.db_conn.execute('DELETE FROM resource_label WHERE resource_id = ?', (rowid,))
+    self.db_conn.executemany('INSERT INTO resource_label VALUES (?, ?)', [(rowid, self._get_label_id(l)) for l in set((labels or '').split())])
+
+  #
+  # labels filter (labels: space separated labels, all required, % wildcards allowed) as a where clause condition
+  def _get_sql_labels_filter(self, case_sensitive, labels, andFlag):
+    if labels == '':
+      return ''
+
+    self._index_labels()
+    conds = []
+    for l in labels.split():
+      col, value = ('name', l) if case_sensitive else ('UPPER(name)', l.upper())
+      op = ' LIKE ' if '%' in value else ' = '
+      conds.append('rowid IN (SELECT resource_id FROM resource_label WHERE label_id IN (SELECT id FROM label WHERE ' + col + op + dcm_util.quote_str(value) + '))')
+    return (' AND (' if andFlag else ' OR (') + ' AND '.join(conds) + ')'
+
+  #
+  # watched file created: its MISSING issue is solved or it is NEW
+  def _watch_created(self, url):
+    if url == self.INTERNAL_HTML_INDEX_FILENAME: return
+    missing = [issue for issue in self.issues if issue.kind == dcm_issue.RepoIssueKind.MISSING and issue.url == url]
+    if len(missing) > 0:
+      self.issues.remove(missing[0])
+      return
+
+    if any(issue.kind == dcm_issue.RepoIssueKind.NEW and issue.url == url for issue in self.issues): return
+    rows = self.db_conn.execute('SELECT rowid FROM resource WHERE kind <> ? AND url = ?', (ResourceKind.BOOKMARK, url)).fetchall()
+    if len(rows) == 0:
+      self.issues.append(dcm_issue.RepoIssue(dcm_issue.RepoIssueKind.NEW, url, -1))
+
+  #
+  # watched file deleted: its NEW issue disappears or its DB entries are MISSING
+  def _watch_deleted(self, url):
+    new = [issue for issue in self.issues if issue.kind == dcm_issue.RepoIssueKind.NEW and issue.url == url]
+    if len(new) > 0:
+      self.issues.remove(new[0])
+      return
+
+    missing_rowids = set(issue.rowid for issue in self.issues if issue.kind == dcm_issue.RepoIssueKind.MISSING)
+    for row in self.db_conn.execute('SELECT rowid FROM resource WHERE kind <> ? AND url = ? ORDER BY rowid', (ResourceKind.BOOKMARK, url)).fetchall():
+      if row[0] not in missing_rowids:
+        self.issues.append(dcm_issue.RepoIssue(dcm_issue.RepoIssueKind.MISSING, url, row[0]))
+
   #
   # Add entry in DB
   def _add_entry_db(self, kind, url, title, lang, labels, keywords, favorite):
     date = datetime.date.today().strftime('%d/%m/%Y')
+    labels = ' '.join(sorted(labels.split())) # same order of the csv import
     row = [kind, url, title, date, self.repo_user, lang, labels, keywords, favorite]
-    sql = 'INSERT INTO resource VALUES (%s)' % dcm_util.quote_list_as_str(row)
-    self.db_conn.execute(sql)
+    sql = 'INSERT INTO resource (' + self.COLS_WRITE + ') VALUES (%s)' % dcm_util.quote_list_as_str(row)
+    rowid = self.db_conn.execute(sql).lastrowid
+    self._set_resource_labels(rowid, labels)
+    self._journal(self.JOURNAL_ADD, rowid, row)
     self.db_conn.commit()
 
+  #
+  # Update a column of an entry in DB
+  def _update_entry_db(self, rowid, col, value):
+    self.db_conn.execute('UPDATE resource SET ' + col + ' = ? WHERE rowid = ?', (value, rowid))
+    if col == 'labels': self._set_resource_labels(rowid, value)
+    self._journal(self.JOURNAL_SET, rowid, [col, value])
+
+  #
+  # Delete an entry from DB
+  def _delete_entry_db(self, rowid):
+    self.db_conn.execute('DELETE FROM resource WHERE rowid = ?', (rowid,))
+    if self.labels_indexed: self.db_conn.execute('DELETE FROM resource_label WHERE resource_id = ?', (rowid,))
+    self._journal(self.JOURNAL_DEL, rowid, [])
+
   #
   # Search labels and fix them with a function (f :: [labels] -> [labels])
   def _fix_label_db(self, label, f):
-    rows = dcm_util.select_db(self.db_conn, 'SELECT rowid, labels FROM resource WHERE labels LIKE ' + dcm_util.quote_str('%' + label + '%'))
+    self._index_labels()
+    rows = self.db_conn.execute('SELECT r.rowid, r.labels FROM label l JOIN resource_label rl ON rl.label_id = l.id JOIN resource r ON r.rowid = rl.resource_id WHERE l.name = ?', (label,)).fetchall()
     for row in rows:
       ls = row[1].split()
       ls = f(ls)
-      self.db_conn.execute('UPDATE resource SET labels = ' + dcm_util.quote_str(' '.join(ls)) + ' WHERE rowid = ' + str(row[0]))
+      ls.sort()
+      self._update_entry_db(row[0], 'labels', ' '.join(ls))
       self.db_conn.commit()
     self._update_labels()
 
   #
   # export elements to html
-  def _save_html(self, filepath):
-    html_template = '''
-<html>
-  <head>
-    <style>
-      <!--
-#myInput {
-    //background-image: url('/css/searchicon.png'); /* Add a search icon to input */
-    background-position: 10px 12px; /* Position the search icon */
-    background-repeat: no-repeat; /* Do not repeat the icon image */
-    width: 100%; /* Full-width */
-    font-size: 16px; /* Increase font-size */
-    padding: 12px 20px 12px 40px; /* Add some padding */
-    border: 1px solid #ddd; /* Add a grey border */
-    margin-bottom: 12px; /* Add some space below the input */
-}
-
-#myTable {
-    border-collapse: collapse; /* Collapse borders */
-    width: 100%; /* Full-width */
-    border: 1px solid #ddd; /* Add a grey border */
-    font-size: 14px; /* Increase font-size */
-}
-
-#myTable th, #myTable td {
-    text-align: left; /* Left-align text */
-    padding: 12px; /* Add padding */
-}
-
-#myTable tr {
-    /* Add a bottom border to all table rows */
-    border-bottom: 1px solid #ddd;
-}
-
-#myTable tr.header, #myTable tr:hover {
-    /* Add a grey background color to the table header and on hover */
-    background-color: #f1f1f1;
-}
-      -->
-    </style>
-
-    <script>
-      <!--
-function myFunction() {
-  var input, filter, table, tr, td, i;
-  input = document.getElementById("myInput");
-  filter = input.value.toUpperCase();
-  table = document.getElementById("myTable");
-  tr = table.getElementsByTagName("tr");
-
-  // Loop through all table rows, and hide those who don't match the search query
-  for (i = 0; i < tr.length; i++) 
-  {
-    // Loop through all table columns
-    found = false;
-
-    tds = tr[i].getElementsByTagName("td");
-    for (j = 0; j < tds.length; j++) 
-    {
-      td = tds[j]; 
-      if (!td) continue;
-      
-      if (td.innerHTML.toUpperCase().indexOf(filter) > -1)
-      {
-        found = true;
-        break;
-      }
-    }
-
-    if (found) tr[i].style.display = "";
-    else tr[i].style.display = "none";
-  }
-}
-      -->
-    </script>
-  </head>
-  <body>
-    <input type="text" id="myInput" onkeyup="myFunction()" placeholder="Search for names..">
-
-%table%
-
-  </body>
-</html>
-    '''
-    
-    # headers
-    headers = '''
-          <tr class="header">
-            <th>kind</th>
-            <th>title</th>
-            <th>date_start</th>
-            <th>author</th>
-            <th>lang</th>
-            <th>labels</th>
-            <th>favorite</th>
-          </tr>
-    '''
-
-    #--- routine to converte a DB row to HTML table row
-    def _row_to_html(row):
-      res = '        <tr>\n'
-      res = res + '          <td>' + row[0] + '</td>\n'
-      #res = res + '          <td><a href="' + self._convert_url(row[0], row[1], True, True) + '">' + row[2] + '</a></td>\n'
-      res = res + '          <td><a href="' + self._convert_url(row[0], row[1], False, False, True) + '">' + row[2] + '</a></td>\n'
-      res = res + '          <td>' + row[3] + '</td>\n'
-      res = res + '          <td>' + row[4] + '</td>\n'
-      res = res + '          <td>' + row[5] + '</td>\n'
-      res = res + '          <td>' + row[6] + '</td>\n'
-      # keywords: res = res + '          <td>' + row[7] + '</td>\n'
-      res = res + '          <td>' + row[8] + '</td>\n'
-      res = res + '        </tr>\n'
-      return res
-    #---
-
-    # filter rows
-    self.update_filtered(self.COLS_WRITE)
-    
-    # convert DB rows to HTML rows
-    html_rows = list(map(lambda row: _row_to_html(row), self.filtered))
-
-    # build html table
-    table = '      <table id="myTable">\n' + headers
-    for row in html_rows:
-      table = table + row
-    table = table + '      </table>\n'
-
-    # write html file
-    file_content = html_template.replace('%table%', table)
-    with open(filepath, 'w') as f:
-      f.write(file_content)
-    f.close()
+  def _save_html(self, filepath, where_clause, orderby_clause, mode = dcm_html.HTML_TABLE):
+    rows = self._iter_db_rows(self.COLS_WRITE, where_clause, orderby_clause)
+    #href_f = lambda row: self._convert_url(row[0], row[1], True, True)
+    href_f = lambda row: self._convert_url(row[0], row[1], False, False, True)
+    dcm_html.write_html(filepath, dcm_html.iter_html(mode, rows, href_f))
@@ -0,0 +1,591 @@
+#
+# Repository directory scan
+#
+
+import os
+import time
+import fnmatch
+import sys
+import queue
+import select
+import struct
+import threading
+import abc
+import contextlib
+import ctypes
+import ctypes.util
+import concurrent.futures
+import dcm_util, dcm_issue
+
+#
+# Repository directory scanner: the directory tree listing is kept as a snapshot in the sqlite sidecar
+# (schema 'cache') and a directory is listed again only when its mtime changes.
+# Files in subdirectories get a relative url ('sub/dir/file.pdf').
+class RepoScanner:
+  RACY_MTIME_NS = 2 * 10**9 # a directory modified so recently could change again within the same mtime
+  DEF_IGNORE = ['.git', '.svn', '__pycache__'] # default ignored names (fnmatch patterns)
+  DEF_WORKERS = 8 # worker threads of a scan
+  PROGRESS_STEP = 500 # items between two progress callbacks
+
+  def __init__(self, db_conn, repo_dir_path, ignore = None):
+    self.db_conn = db_conn
+    self.repo_dir_path = repo_dir_path
+    self.ignore = list(self.DEF_IGNORE if ignore is None else ignore) # names/relative paths not scanned (subtrees included)
+    self.executor = None # worker pool (see running)
+    self.progress = None # progress callback (see running)
+
+  #
+  # create the snapshot tables
+  def create_tables(self):
+    self.db_conn.execute('CREATE TABLE IF NOT EXISTS cache.scan_dir (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER)')
+    self.db_conn.execute('CREATE TABLE IF NOT EXISTS cache.scan_file (url TEXT PRIMARY KEY, dir TEXT, size INTEGER, mtime_ns INTEGER, inode INTEGER)')
+    self.db_conn.execute('CREATE INDEX IF NOT EXISTS cache.scan_file_dir ON scan_file (dir)')
+    self.db_conn.execute('CREATE TABLE IF NOT EXISTS cache.file_hash (url TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT)')
+
+  #
+  # forget the snapshot: the next scan lists every directory again
+  def reset_snapshot(self):
+    self.db_conn.execute('DELETE FROM cache.scan_dir')
+    self.db_conn.execute('DELETE FROM cache.scan_file')
+
+  #
+  # True if a directory entry (name, relative url) is ignored
+  def is_ignored(self, name, url):
+    for pattern in self.ignore:
+      if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(url, pattern):
+        return True
+    return False
+
+  #
+  # run the scan operations with a pool of worker threads (stat/hash are latency bound on network or 
+  # spinning disks); progress :: (phase, done, total) -> None is called from the calling thread
+  @contextlib.contextmanager
+  def running(self, workers, progress = None):
+    self.progress = progress
+    self.executor = concurrent.futures.ThreadPoolExecutor(workers) if workers > 1 else None
+    try:
+      yield self
+    finally:
+      if self.executor is not None: self.executor.shutdown(cancel_futures=True)
+      self.executor = None
+      self.progress = None
+
+  #
+  # list the repository files (relative urls); directories with unchanged mtime come from the snapshot.
+  # The tree is visited one level at a time, the directories of a level are listed in parallel
+  def list_files(self):
+    old_dirs = {} # path -> (parent, mtime_ns)
+    for path, parent, mtime_ns in self.db_conn.execute('SELECT path, parent, mtime_ns FROM cache.scan_dir'):
+      old_dirs[path] = (parent, mtime_ns)
+    children = {} # parent -> [subdirectory paths]
+    for path, (parent, mtime_ns) in old_dirs.items():
+      if path != '': children.setdefault(parent, []).append(path)
+
+    now_ns = time.time_ns()
+    urls = []
+    new_dirs = [] # (path, parent, mtime_ns) of the visited directories
+    changed_files = {} # dir path -> files rows of the listed directories
+    level = [('', '')]
+    while level:
+      dir_mtimes = self._map(self._dir_mtime, [path for path, parent in level], 'dirs')
+
+      next_level = []
+      to_list = []
+      for (path, parent), dir_mtime_ns in zip(level, dir_mtimes):
+        if dir_mtime_ns is None: continue # vanished
+        old = old_dirs.get(path)
+        if old is not None and old[1] == dir_mtime_ns and old[0] == parent:
+          urls.extend(row[0] for row in self.db_conn.execute('SELECT url FROM cache.scan_file WHERE dir = ? ORDER BY rowid', (path,)))
+          next_level.extend((p, path) for p in children.get(path, []) if not self.is_ignored(os.path.basename(p), p))
+        else:
+          to_list.append(path)
+          if now_ns - dir_mtime_ns < self.RACY_MTIME_NS:
+            dir_mtime_ns = -1 # list it again next time
+        new_dirs.append((path, parent, dir_mtime_ns))
+
+      # list the changed directories, then stat their new entries
+      listed = self._map(self._scan_dir, to_list, 'list')
+      to_stat = []
+      for path, (entries, subdirs) in zip(to_list, listed):
+        known = {}
+        for url, size, mtime_ns, inode in self.db_conn.execute('SELECT url, size, mtime_ns, inode FROM cache.scan_file WHERE dir = ?', (path,)):
+          known[url] = (size, mtime_ns, inode)
+
+        files = changed_files[path] = []
+        for url, entry, inode, st in entries:
+          if st is not None:
+            files.append((url, path, st.st_size, st.st_mtime_ns, inode))
+            continue
+          old = known.get(url)
+          if old is not None and old[2] == inode:
+            files.append((url, path, old[0], old[1], inode))
+          else:
+            files.append(None)
+            to_stat.append((files, len(files) - 1, url, path, entry, inode))
+        next_level.extend((subdir, path) for subdir in subdirs)
+
+      sts = self._map(lambda x: self._stat_entry(x[4]), to_stat, 'stat')
+      for (files, i, url, path, entry, inode), st in zip(to_stat, sts):
+        if st is not None: files[i] = (url, path, st.st_size, st.st_mtime_ns, inode)
+      for path in to_list:
+        files = changed_files[path] = [f for f in changed_files[path] if f is not None]
+        urls.extend(f[0] for f in files)
+
+      level = next_level
+
+    # update the snapshot (listed directories and vanished ones)
+    visited = set(d[0] for d in new_dirs)
+    with self.db_conn:
+      for path in list(changed_files) + [p for p in old_dirs if p not in visited]:
+        self.db_conn.execute('DELETE FROM cache.scan_file WHERE dir = ?', (path,))
+      for files in changed_files.values():
+        self.db_conn.executemany('INSERT OR REPLACE INTO cache.scan_file VALUES (?, ?, ?, ?, ?)', files)
+      self.db_conn.execute('DELETE FROM cache.scan_dir')
+      self.db_conn.executemany('INSERT INTO cache.scan_dir VALUES (?, ?, ?)', new_dirs)
+    return urls
+
+  #
+  # content fingerprints ('size:hash') of listed files, recomputed only when the file size/mtime changed
+  def get_fingerprints(self, urls):
+    urls = set(urls)
+    items = [row for row in self.db_conn.execute('SELECT url, size, mtime_ns FROM cache.scan_file') if row[0] in urls]
+    return self._fingerprints(items)
+
+  #
+  # groups (lists of urls) of listed files with the same content: the files are stat-ed (the snapshot size/mtime
+  # can be outdated, editing a file doesn't touch its directory mtime) and grouped by size, then by fingerprint
+  # (first/middle/last blocks, cached by size/mtime) and every remaining group is confirmed by full content hash
+  def find_duplicates(self, urls):
+    urls = sorted(set(urls))
+    by_size = {}
+    for url, st in zip(urls, self._map(self._stat_url, urls, 'stat')):
+      if st is not None and st.st_size > 0: by_size.setdefault(st.st_size, []).append((url, st.st_size, st.st_mtime_ns))
+    candidates = [item for group in by_size.values() if len(group) > 1 for item in group]
+
+    by_fingerprint = {}
+    for url, fp in sorted(self._fingerprints(candidates).items()):
+      by_fingerprint.setdefault(fp, []).append(url)
+    to_hash = [url for group in by_fingerprint.values() if len(group) > 1 for url in group]
+
+    by_hash = {}
+    for url, h in zip(to_hash, self._map(self._full_hash, to_hash, 'hash')):
+      if h is not None: by_hash.setdefault(h, []).append(url)
+    return sorted(group for group in by_hash.values() if len(group) > 1)
+
+  #
+  # fingerprints of the files ((url, size, mtime_ns) items), recomputed only when the size/mtime changed
+  def _fingerprints(self, items):
+    cached = {}
+    for url, size, mtime_ns, h in self.db_conn.execute('SELECT url, size, mtime_ns, hash FROM cache.file_hash'):
+      cached[url] = (size, mtime_ns, h)
+    res = {}
+    to_hash = []
+    for url, size, mtime_ns in items:
+      c = cached.get(url)
+      if c is not None and c[0] == size and c[1] == mtime_ns:
+        res[url] = '%d:%s' % (size, c[2])
+      else:
+        to_hash.append((url, size, mtime_ns))
+
+    hashed = []
+    for url, h in zip([x[0] for x in to_hash], self._map(self._hash_file, [x[0] for x in to_hash], 'hash')):
+      if h is None: continue
+      res[url] = '%d:%s' % (h[0], h[2])
+      hashed.append((url,) + h)
+    with self.db_conn:
+      self.db_conn.executemany('INSERT OR REPLACE INTO cache.file_hash VALUES (?, ?, ?, ?)', hashed)
+      self.db_conn.executemany('UPDATE cache.scan_file SET size = ?, mtime_ns = ? WHERE url = ?', [(h[1], h[2], h[0]) for h in hashed])
+    return res
+
+  #
+  # last known content fingerprints of files (also the ones no longer in the directory)
+  def get_cached_fingerprints(self, urls):
+    res = {}
+    for url in urls:
+      for size, h in self.db_conn.execute('SELECT size, hash FROM cache.file_hash WHERE url = ?', (url,)):
+        res[url] = '%d:%s' % (size, h)
+    return res
+
+  #
+  # forget the fingerprints of the files not in the keep set
+  def prune_fingerprints(self, keep_urls):
+    urls = [row[0] for row in self.db_conn.execute('SELECT url FROM cache.file_hash') if row[0] not in keep_urls]
+    with self.db_conn:
+      self.db_conn.executemany('DELETE FROM cache.file_hash WHERE url = ?', [(url,) for url in urls])
+
+  #
+  # list a directory (relative path) with os.scandir: files ((url, DirEntry, inode, stat or None)) and
+  # subdirectories (the entry type comes from the DirEntry, no stat). The file identity is what the listing
+  # gives for free: the inode on POSIX (readdir, the file is stat-ed only if it changed), size and mtime on
+  # Windows (FindNextFile fills DirEntry.stat(), while DirEntry.inode() costs a system call there)
+  def _scan_dir(self, path):
+    entries = []
+    subdirs = []
+    with os.scandir(self._abs_path(path)) as it:
+      for entry in it:
+        url = entry.name if path == '' else path + '/' + entry.name
+        if self.is_ignored(entry.name, url): continue
+
+        if entry.is_dir():
+          subdirs.append(url)
+        elif entry.is_file():
+          if os.name == 'nt':
+            st = self._stat_entry(entry)
+            if st is not None: entries.append((url, entry, 0, st))
+          else:
+            entries.append((url, entry, entry.inode(), None))
+    return entries, subdirs
+
+  #
+  # mtime of a directory (None if it does not exist anymore)
+  def _dir_mtime(self, path):
+    try:
+      return os.stat(self._abs_path(path)).st_mtime_ns
+    except FileNotFoundError:
+      if path == '': raise
+      return None
+
+  #
+  # stat of a directory entry (None if it does not exist anymore)
+  def _stat_entry(self, entry):
+    try:
+      return entry.stat()
+    except OSError:
+      return None
+
+  #
+  # (size, mtime_ns, fingerprint hash) of a file, None if not readable; the file is stat-ed again
+  # since its snapshot size/mtime could be outdated (content changes don't touch the directory mtime)
+  def _hash_file(self, url):
+    filepath = self._abs_path(url)
+    try:
+      st = os.stat(filepath)
+      return (st.st_size, st.st_mtime_ns, dcm_util.file_fingerprint(filepath, st.st_size))
+    except OSError:
+      return None
+
+  #
+  # stat of a file (None if not readable)
+  def _stat_url(self, url):
+    try:
+      return os.stat(self._abs_path(url))
+    except OSError:
+      return None
+
+  #
+  # full content hash of a file (None if not readable)
+  def _full_hash(self, url):
+    try:
+      return dcm_util.file_hash(self._abs_path(url))
+    except OSError:
+      return None
+
+  #
+  # apply f to the items with the worker pool (if running), results in the same order of the items
+  def _map(self, f, items, phase):
+    if len(items) == 0: return []
+    if self.executor is None or len(items) == 1:
+      results = map(f, items)
+    else:
+      results = self.executor.map(f, items)
+
+    res = []
+    for r in results:
+      res.append(r)
+      if self.progress is not None and (len(res) % self.PROGRESS_STEP == 0 or len(res) == len(items)):
+        self.progress(phase, len(res), len(items))
+    return res
+
+  #
+  # absolute path of a relative url
+  def _abs_path(self, url):
+    return os.path.join(self.repo_dir_path, url) if url != '' else self.repo_dir_path
+
+#
+# Compare the repository files with the DB entries (db_values: [(url, rowid)] in DB order)
+# and return the NEW/MISSING issues
+def diff_files(filenames, db_values, ignored = ()):
+  db_urls = set(value[0] for value in db_values)
+  matched = {} # url -> number of files matching it (a DB entry is matched once)
+
+  issues = []
+  for filename in filenames:
+    if filename in ignored:
+      continue
+
+    if filename in db_urls:
+      matched[filename] = matched.get(filename, 0) + 1
+    else:
+      issues.append(dcm_issue.RepoIssue(dcm_issue.RepoIssueKind.NEW, filename, -1))
+
+  for url, rowid in db_values:
+    n = matched.get(url, 0)
+    if n > 0:
+      matched[url] = n - 1
+    else:
+      issues.append(dcm_issue.RepoIssue(dcm_issue.RepoIssueKind.MISSING, url, rowid))
+  return issues
+
+#
+# Pair MISSING and NEW issues with the same content fingerprint (fingerprints: url -> fingerprint);
+# a fingerprint shared by more than one MISSING or NEW issue is ambiguous and left alone (as empty files)
+def find_moved(issues, fingerprints):
+  missing = {}
+  new = {}
+  for issue in issues:
+    fp = fingerprints.get(issue.url)
+    if fp is None or fp.startswith('0:'): continue # empty files can't be told apart
+    if issue.kind == dcm_issue.RepoIssueKind.MISSING:
+      missing.setdefault(fp, []).append(issue)
+    elif issue.kind == dcm_issue.RepoIssueKind.NEW:
+      new.setdefault(fp, []).append(issue)
+
+  return [(missing[fp][0], new[fp][0]) for fp in missing if len(missing[fp]) == 1 and len(new.get(fp, [])) == 1]
+
+#
+# Watcher events (kind, url)
+class WatchEvent:
+  CREATED = 'created'         # file created/moved in the repository
+  DELETED = 'deleted'         # file deleted/moved out of the repository
+  DELETED_DIR = 'deleted_dir' # directory (and all its files) deleted/moved out of the repository
+  RESCAN = 'rescan'           # events lost, a full scan is needed
+
+#
+# Repository directory watcher base: a background thread puts WatchEvent tuples in a queue,
+# they are consumed by the thread owning the DB (see RepoManager.apply_watch_events)
+class RepoWatcher(abc.ABC):
+  def __init__(self, repo_dir_path, is_ignored):
+    self.repo_dir_path = repo_dir_path
+    self.is_ignored = is_ignored # (name, url) -> bool
+    self.events = queue.Queue()
+    self.stop_event = threading.Event()
+    self.thread = threading.Thread(target=self.run, daemon=True)
+
+  def start(self):
+    self.thread.start()
+
+  def stop(self):
+    self.stop_event.set()
+    self.thread.join()
+
+  #
+  # get the pending events (non blocking)
+  def get_events(self):
+    res = []
+    while True:
+      try:
+        res.append(self.events.get_nowait())
+      except queue.Empty:
+        return res
+
+  #
+  # thread body: watch the repository and put the events in the queue until stop_event is set
+  @abc.abstractmethod
+  def run(self):
+    pass
+
+  #
+  # relative url of a name inside a directory (relative path)
+  def _url(self, path, name):
+    return name if path == '' else path + '/' + name
+
+  #
+  # directories and files (relative urls) of a subtree, ignored entries excluded;
+  # visit(abs_path, path) is called on every directory before it is listed
+  def _walk(self, path, visit = None):
+    dirs = []
+    files = []
+    todo = [path]
+    while todo:
+      d = todo.pop()
+      dirs.append(d)
+      if visit is not None:
+        visit(os.path.join(self.repo_dir_path, d) if d != '' else self.repo_dir_path, d)
+      try:
+        with os.scandir(os.path.join(self.repo_dir_path, d) if d != '' else self.repo_dir_path) as it:
+          for entry in it:
+            url = self._url(d, entry.name)
+            if self.is_ignored(entry.name, url): continue
+            if entry.is_dir(): todo.append(url)
+            elif entry.is_file(): files.append(url)
+      except OSError:
+        pass
+    return dirs, files
+
+#
+# Linux watcher (inotify through ctypes)
+class InotifyWatcher(RepoWatcher):
+  IN_MOVED_FROM = 0x40
+  IN_MOVED_TO = 0x80
+  IN_CREATE = 0x100
+  IN_DELETE = 0x200
+  IN_Q_OVERFLOW = 0x4000
+  IN_IGNORED = 0x8000
+  IN_ISDIR = 0x40000000
+  IN_CLOEXEC = 0o2000000
+  MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+  EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+  #
+  # True if inotify can be used
+  @staticmethod
+  def available():
+    if not sys.platform.startswith('linux'): return False
+    libc_name = ctypes.util.find_library('c')
+    if libc_name is None: return False
+    return hasattr(ctypes.CDLL(libc_name), 'inotify_init1')
+
+  def __init__(self, repo_dir_path, is_ignored):
+    super().__init__(repo_dir_path, is_ignored)
+    self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+    self.wds = {} # watch descriptor -> directory relative path
+
+  def run(self):
+    try:
+      self._add_watches('')
+      while not self.stop_event.is_set():
+        r, w, x = select.select([self.fd], [], [], 0.5)
+        if r: self._read_events(os.read(self.fd, 64 * 1024))
+    finally:
+      os.close(self.fd)
+
+  #
+  # watch a subtree (return its files): every directory is watched before it is listed, so that
+  # the entries created meanwhile are either listed or notified (twice at worst)
+  def _add_watches(self, path):
+    dirs, files = self._walk(path, self._add_watch)
+    return files
+
+  def _add_watch(self, abs_path, path):
+    wd = self.libc.inotify_add_watch(self.fd, os.fsencode(abs_path), self.MASK)
+    if wd >= 0: self.wds[wd] = path
+
+  #
+  # stop watching a subtree (removed or moved out of the repository)
+  def _remove_watches(self, path):
+    for wd, d in list(self.wds.items()):
+      if d == path or d.startswith(path + '/'):
+        self.libc.inotify_rm_watch(self.fd, wd)
+        del self.wds[wd]
+
+  def _read_events(self, buf):
+    i = 0
+    while i + self.EVENT_HEADER.size <= len(buf):
+      wd, mask, cookie, name_len = self.EVENT_HEADER.unpack_from(buf, i)
+      name = os.fsdecode(buf[i + self.EVENT_HEADER.size:i + self.EVENT_HEADER.size + name_len].rstrip(b'\0'))
+      i += self.EVENT_HEADER.size + name_len
+
+      if mask & self.IN_Q_OVERFLOW:
+        self.events.put((WatchEvent.RESCAN, ''))
+        continue
+      if mask & self.IN_IGNORED:
+        self.wds.pop(wd, None)
+        continue
+      path = self.wds.get(wd)
+      if path is None or name == '': continue
+      url = self._url(path, name)
+      if self.is_ignored(name, url): continue
+
+      if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+        if mask & self.IN_ISDIR:
+          for f in self._add_watches(url):
+            self.events.put((WatchEvent.CREATED, f))
+        else:
+          self.events.put((WatchEvent.CREATED, url))
+      elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+        if mask & self.IN_ISDIR:
+          self._remove_watches(url)
+          self.events.put((WatchEvent.DELETED_DIR, url))
+        else:
+          self.events.put((WatchEvent.DELETED, url))
+
+#
+# Portable watcher: directory mtimes polled every interval seconds
+class PollWatcher(RepoWatcher):
+  def __init__(self, repo_dir_path, is_ignored, interval = 2.0):
+    super().__init__(repo_dir_path, is_ignored)
+    self.interval = interval
+    self.dirs = {} # directory relative path -> (mtime_ns, files set, subdirectories set)
+
+  def run(self):
+    self._list_tree('')
+    while not self.stop_event.wait(self.interval):
+      for path in list(self.dirs):
+        if path not in self.dirs: continue # removed with its parent
+        try:
+          mtime_ns = os.stat(self._abs(path)).st_mtime_ns
+        except OSError:
+          continue # its parent reports it
+        if mtime_ns != self.dirs[path][0]:
+          self._update_dir(path)
+
+  def _abs(self, path):
+    return os.path.join(self.repo_dir_path, path) if path != '' else self.repo_dir_path
+
+  #
+  # list a directory: (mtime_ns, files, subdirectories)
+  def _list_dir(self, path):
+    files = set()
+    subdirs = set()
+    mtime_ns = os.stat(self._abs(path)).st_mtime_ns
+    with os.scandir(self._abs(path)) as it:
+      for entry in it:
+        url = self._url(path, entry.name)
+        if self.is_ignored(entry.name, url): continue
+        if entry.is_dir(): subdirs.add(url)
+        elif entry.is_file(): files.add(url)
+    return (mtime_ns, files, subdirs)
+
+  #
+  # list a subtree (return its files)
+  def _list_tree(self, path):
+    res = []
+    todo = [path]
+    while todo:
+      d = todo.pop()
+      try:
+        self.dirs[d] = self._list_dir(d)
+      except OSError:
+        continue
+      res.extend(self.dirs[d][1])
+      todo.extend(self.dirs[d][2])
+    return res
+
+  #
+  # drop a subtree
+  def _forget_tree(self, path):
+    for d in [d for d in self.dirs if d == path or d.startswith(path + '/')]:
+      del self.dirs[d]
+
+  #
+  # list again a changed directory and emit its events
+  def _update_dir(self, path):
+    old_mtime_ns, old_files, old_subdirs = self.dirs[path]
+    try:
+      self.dirs[path] = self._list_dir(path)
+    except OSError:
+      return
+    mtime_ns, files, subdirs = self.dirs[path]
+    for url in sorted(files - old_files):
+      self.events.put((WatchEvent.CREATED, url))
+    for url in sorted(old_files - files):
+      self.events.put((WatchEvent.DELETED, url))
+    for url in sorted(old_subdirs - subdirs):
+      self._forget_tree(url)
+      self.events.put((WatchEvent.DELETED_DIR, url))
+    for url in sorted(subdirs - old_subdirs):
+      for f in self._list_tree(url):
+        self.events.put((WatchEvent.CREATED, f))
+
+#
+# Create the best watcher available on this platform (inotify on linux, polling otherwise)
+def make_watcher(repo_dir_path, is_ignored, poll_interval = 2.0):
+  if InotifyWatcher.available():
+    try:
+      return InotifyWatcher(repo_dir_path, is_ignored)
+    except OSError:
+      pass
+  return PollWatcher(repo_dir_path, is_ignored, poll_interval)
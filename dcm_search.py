@@ -0,0 +1,678 @@
+#
+# Document content search
+#
+
+import codecs
+import concurrent.futures
+import contextlib
+import mmap
+import os
+import re
+import shlex
+import sqlite3
+import subprocess
+import threading
+import time
+import zlib
+
+PDF_EXT = '.pdf'
+MAX_TEXT_SIZE = 32 * 1024 * 1024 # longest text (bytes of a file, characters of a pdf) cached and indexed, longer documents are searched in place
+BINARY_SNIFF_SIZE = 8 * 1024 # bytes of a file checked for a NUL byte (binary files have no text, they are searched in place)
+CHUNK_SIZE = 64 * 1024 # bytes read at a time from a document (or its extractor)
+SEARCH_CHUNK_SIZE = 4 * 1024 * 1024 # bytes read at a time by BytesMatcher/RegexMatcher
+REGEX_OVERLAP = 64 * 1024 # bytes shared by two chunks searched by RegexMatcher (longest match across chunks)
+DEF_MAX_HITS = 10 # hits collected per document by RegexMatcher
+RANK_BOOSTS = [('title', 2.0), ('labels', 1.5), ('keywords', 1.0)] # rank added per query term found in the column
+SNIPPET_TOKENS = 12 # tokens of a ranked search snippet
+
+# pdf text extractor command writing the text to stdout ({} is the pdf path),
+# can be overridden with the DCM_PDF_EXTRACTOR environment variable (split as the shell of the platform would:
+# on Windows backslashes are path separators, "quoted" arguments lose their quotes)
+PDF_EXTRACTOR = [('pdftotext.exe' if os.name == 'nt' else 'pdftotext'), '-nopgbrk', '-enc', 'UTF-8', '{}', '-']
+if os.environ.get('DCM_PDF_EXTRACTOR'):
+  PDF_EXTRACTOR = shlex.split(os.environ['DCM_PDF_EXTRACTOR'], posix=(os.name != 'nt'))
+  if os.name == 'nt':
+    PDF_EXTRACTOR = [arg[1:-1] if len(arg) > 1 and arg[0] == arg[-1] == '"' else arg for arg in PDF_EXTRACTOR]
+DEF_TEXT_CACHE_SIZE = 256 * 1024 * 1024 # budget (compressed bytes) of the extracted text cache
+DEF_WORKERS = os.cpu_count() or 4 # concurrent text extractions of a search
+
+#
+# Cancellation of the text extractions running in worker threads: cancel() sets the event checked by
+# iter_text_chunks and kills the extractor processes it registered, so the ones already running stop at once
+class CancelEvent:
+  def __init__(self):
+    self.event = threading.Event()
+    self.lock = threading.Lock()
+    self.procs = set() # running extractor processes
+
+  def cancel(self):
+    with self.lock:
+      self.event.set()
+      for proc in self.procs:
+        proc.kill()
+
+  def is_set(self):
+    return self.event.is_set()
+
+  #
+  # track a running extractor process, killed at once if already cancelled
+  def add(self, proc):
+    with self.lock:
+      self.procs.add(proc)
+      if self.event.is_set(): proc.kill()
+
+  def discard(self, proc):
+    with self.lock:
+      self.procs.discard(proc)
+
+#
+# Text of a document as an iterator of string chunks: a pdf is streamed from the stdout of the extractor
+# (PDF_EXTRACTOR), other files are read as utf-8 text. Closing the iterator early stops the extractor, as
+# does cancel (a CancelEvent): the text of a cancelled extraction ends early and is to be discarded
+def iter_text_chunks(filepath, chunk_size = CHUNK_SIZE, cancel = None):
+  decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+  if os.path.splitext(filepath)[1].lower() == PDF_EXT:
+    proc = subprocess.Popen([filepath if arg == '{}' else arg for arg in PDF_EXTRACTOR], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if cancel is not None: cancel.add(proc)
+    try:
+      while cancel is None or not cancel.is_set():
+        data = proc.stdout.read(chunk_size)
+        if not data: break
+        yield decoder.decode(data)
+    finally:
+      proc.stdout.close()
+      if proc.poll() is None: proc.kill()
+      proc.wait()
+      if cancel is not None: cancel.discard(proc)
+  else:
+    with open(filepath, 'rb') as file:
+      while cancel is None or not cancel.is_set():
+        data = file.read(chunk_size)
+        if not data: break
+        yield decoder.decode(data)
+  yield decoder.decode(b'', True)
+
+#
+# True if the file is binary (not a pdf and a NUL byte in its first BINARY_SNIFF_SIZE bytes)
+def is_binary(filepath):
+  if os.path.splitext(filepath)[1].lower() == PDF_EXT:
+    return False
+  with open(filepath, 'rb') as file:
+    return b'\0' in file.read(BINARY_SNIFF_SIZE)
+
+#
+# f(item, cancel) applied to the items by a pool of workers threads (I/O bound work: reading the files or
+# waiting for the extractor), as an iterator of (item, result) in completion order; the items whose f raises
+# OSError (unreadable files) are skipped. Closing the iterator early (or Ctrl-C) drops the pending items and
+# cancels the running ones (cancel, a CancelEvent: see iter_text_chunks)
+def iter_map(f, items, workers = DEF_WORKERS):
+  if workers <= 1:
+    for item in items:
+      try:
+        res = f(item, None)
+      except OSError:
+        continue
+      yield item, res
+    return
+
+  executor = concurrent.futures.ThreadPoolExecutor(workers)
+  cancel = CancelEvent()
+  try:
+    futures = {}
+    for item in items:
+      futures[executor.submit(f, item, cancel)] = item
+    for future in concurrent.futures.as_completed(futures):
+      try:
+        res = future.result()
+      except OSError:
+        continue
+      yield futures[future], res
+  finally:
+    cancel.cancel()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+#
+# Extract the text of a document, None if it has no text to cache: a binary file or a text longer than
+# MAX_TEXT_SIZE (the extraction stops there), such documents are searched in place (see find_terms).
+# cancel: see iter_text_chunks
+def extract_text(filepath, cancel = None):
+  if is_binary(filepath) or (os.path.splitext(filepath)[1].lower() != PDF_EXT and os.path.getsize(filepath) > MAX_TEXT_SIZE):
+    return None
+  chunks = []
+  size = 0
+  with contextlib.closing(iter_text_chunks(filepath, CHUNK_SIZE, cancel)) as it:
+    for chunk in it:
+      chunks.append(chunk)
+      size += len(chunk)
+      if size > MAX_TEXT_SIZE: return None
+  return ''.join(chunks)
+
+#
+# set of the terms (of a BytesMatcher) contained in a document without a cached text (see extract_text): a pdf
+# is matched in its streamed text (see text_find_terms), other files in their bytes (a single read for all the
+# terms). The text is not needed beyond the last term found, so both stop there. cancel: see iter_text_chunks
+def find_terms(filepath, matcher, cancel = None):
+  if os.path.splitext(filepath)[1].lower() == PDF_EXT:
+    return text_find_terms(filepath, matcher.terms, matcher.fold, cancel)
+  return matcher.find_file(filepath)
+
+#
+# set of the terms contained in the text of a document; all the terms are matched in a single pass while
+# the text is streamed, and the reading (or the extractor) stops as soon as all of them are found.
+# cancel: see iter_text_chunks
+def text_find_terms(filepath, terms, case_insensitive, cancel = None):
+  matcher = MultiMatcher(terms, case_insensitive)
+  overlap = max([len(key) for key in matcher.terms] + [1]) - 1 # longest folded term
+  found = set()
+  tail = '' # end of the previous chunk, for the matches across two chunks
+  with contextlib.closing(iter_text_chunks(filepath, CHUNK_SIZE, cancel)) as it:
+    for chunk in it:
+      buf = tail + chunk
+      found.update(matcher.find(buf))
+      if len(found) == len(set(terms)): break
+      tail = buf[len(buf) - overlap:] if overlap > 0 else ''
+  return found
+
+#
+# Decompress a text stored by TextCache (None stays None), registered as the dcm_unzip sqlite function
+def unzip_text(data):
+  return None if data is None else zlib.decompress(data).decode('utf-8')
+
+#
+# Matcher of strings (terms) in the utf-8 bytes of a file, without decoding it (so binary or badly encoded
+# content is fine). Case sensitive terms are searched in the memory mapped file (no copy); case insensitive
+# ones are searched in fixed size chunks (a single reused buffer, each chunk preceded by the tail of the
+# previous one) folded once with bytes.lower() for all the terms, the non ascii letters of a term (not folded
+# by bytes.lower) match the utf-8 bytes of both their cases through a regex. The file is read once whatever
+# the number of terms, the reading stops when all of them are found; the memory needed doesn't depend on
+# the file size
+class BytesMatcher:
+  def __init__(self, terms, case_insensitive):
+    self.terms = terms
+    self.fold = case_insensitive # ascii case folding of the chunks
+    self.patterns = []           # (term, needle, regex (case insensitive terms with non ascii letters) or None, longest match)
+    for term in terms:
+      needle = term.encode('utf8')
+      regex = None
+      max_len = len(needle)
+      if case_insensitive:
+        needle = needle.lower()
+        if not term.isascii():
+          parts = []
+          max_len = 0
+          for c in term:
+            forms = sorted(set(f.encode('utf8').lower() for f in (c, c.lower(), c.upper())))
+            parts.append(re.escape(forms[0]) if len(forms) == 1 else b'(?:' + b'|'.join(map(re.escape, forms)) + b')')
+            max_len += max(map(len, forms))
+          regex = re.compile(b''.join(parts))
+      self.patterns.append((term, needle, regex, max_len))
+
+  #
+  # set of the terms contained in the file
+  def find_file(self, filepath, use_mmap = True, chunk_size = SEARCH_CHUNK_SIZE):
+    with open(filepath, 'rb', 0) as file:
+      if os.fstat(file.fileno()).st_size == 0:
+        return set(p[0] for p in self.patterns if p[3] == 0)
+      if use_mmap and not self.fold:
+        try:
+          with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return set(p[0] for p in self.patterns if self._search(mm, len(mm), p))
+        except (OSError, ValueError, OverflowError):
+          pass # can't be mapped (e.g. bigger than the address space)
+
+      found = set()
+      patterns = self.patterns
+      buf = bytearray(chunk_size + max(p[3] for p in patterns))
+      keep = 0 # overlap bytes at the start of buf
+      while patterns:
+        n = file.readinto(memoryview(buf)[keep:keep + chunk_size])
+        if not n: break
+        end = keep + n
+        data = buf.lower() if self.fold else buf
+        found.update(p[0] for p in patterns if self._search(data, end, p))
+        patterns = [p for p in patterns if p[0] not in found]
+        keep = min(max([p[3] - 1 for p in patterns] + [0]), end)
+        buf[:keep] = buf[end - keep:end]
+      return found
+
+  def _search(self, data, end, pattern):
+    term, needle, regex, max_len = pattern
+    if regex is not None:
+      return regex.search(data, 0, end) is not None
+    return data.find(needle, 0, end) != -1
+
+#
+# Regex (or whole word) matcher: the pattern is compiled once, as a bytes regex for the files searched in
+# place (memory mapped, their utf-8 bytes: case folding, \b and \w are ascii only) and as a string regex
+# for the extracted texts (pdf). A search collects the offsets of the first max_hits matches, then stops
+class RegexMatcher:
+  def __init__(self, pattern, case_insensitive, whole_word = False, is_regex = True, max_hits = DEF_MAX_HITS):
+    if not is_regex:
+      pattern = re.escape(pattern)
+    if whole_word:
+      pattern = r'\b(?:' + pattern + r')\b'
+    flags = re.IGNORECASE if case_insensitive else 0
+    try:
+      self.text_regex = re.compile(pattern, flags)
+      self.bytes_regex = re.compile(pattern.encode('utf8'), flags)
+    except re.error as ex:
+      raise ValueError(str(ex))
+    self.max_hits = max_hits
+
+  #
+  # offsets of the first matches in the text
+  def search_text(self, text):
+    return self._first_hits(self.text_regex.finditer(text), len(text) + 1)
+
+  #
+  # byte offsets of the first matches in the file content
+  def search_file(self, filepath, use_mmap = True, chunk_size = SEARCH_CHUNK_SIZE):
+    with open(filepath, 'rb', 0) as file:
+      if os.fstat(file.fileno()).st_size == 0:
+        return self.search_text('')
+      if use_mmap:
+        try:
+          with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return self._first_hits(self.bytes_regex.finditer(mm), len(mm) + 1)
+        except (OSError, ValueError, OverflowError):
+          pass # can't be mapped (e.g. bigger than the address space)
+
+      return self._search_chunks(self.bytes_regex, iter(lambda: file.read(chunk_size), b''), b'')
+
+  #
+  # offsets of the first matches in the text of a pdf, streamed from the extractor (text not cached),
+  # cancel: see iter_text_chunks
+  def search_pdf(self, filepath, cancel = None):
+    with contextlib.closing(iter_text_chunks(filepath, CHUNK_SIZE, cancel)) as it:
+      return self._search_chunks(self.text_regex, it, '')
+
+  #
+  # offsets of the first matches in the content given as chunks (bytes or strings, empty is their empty value):
+  # every round searches the carried tail (REGEX_OVERLAP long) plus a new chunk, the matches starting in the tail
+  # are counted in the next round (except in the last one). The REGEX_OVERLAP chars before the tail are kept
+  # as context and the search starts after them, so that ^, \b and lookbehinds see the previous chars
+  def _search_chunks(self, regex, chunks, empty):
+    hits = []
+    buf = empty
+    base = 0 # offset of buf
+    pos = 0 # offset in buf of the tail (buf[:pos] is context only)
+    while len(hits) < self.max_hits:
+      data = next(chunks, empty)
+      buf = buf + data
+      limit = max(pos, len(buf) - REGEX_OVERLAP) if data else len(buf) + 1
+      for offset in self._first_hits(regex.finditer(buf, pos), limit):
+        hits.append(base + offset)
+        if len(hits) == self.max_hits: break
+      if not data: break
+      cut = max(0, limit - REGEX_OVERLAP)
+      base += cut
+      buf = buf[cut:]
+      pos = limit - cut
+    return hits
+
+  #
+  # offsets of the first max_hits matches starting before end
+  def _first_hits(self, matches, end):
+    hits = []
+    for m in matches:
+      if m.start() >= end: break
+      hits.append(m.start())
+      if len(hits) == self.max_hits: break
+    return hits
+
+#
+# Boolean search query: terms (words or "quoted phrases") combined with AND (also implicit), OR, NOT
+# and parentheses, e.g.  sqlite "full text" OR fts NOT (draft OR old)
+class Query:
+  TERM = 'term'
+  AND = 'AND'
+  OR = 'OR'
+  NOT = 'NOT'
+
+  TOKEN_RE = re.compile(r'"([^"]*)("?)|([()])|([^\s()"]+)')
+
+  def __init__(self, text):
+    self.tokens = [] # (kind, value)
+    for m in self.TOKEN_RE.finditer(text):
+      if m.group(3) is not None:
+        self.tokens.append((m.group(3), m.group(3)))
+      elif m.group(4) is not None:
+        w = m.group(4)
+        self.tokens.append((w, w) if w in (self.AND, self.OR, self.NOT) else (self.TERM, w))
+      else:
+        if m.group(2) == '': raise ValueError('unterminated phrase: "' + m.group(1))
+        if m.group(1).strip() != '': self.tokens.append((self.TERM, m.group(1)))
+    if not self.tokens: raise ValueError('empty query')
+
+    self.pos = 0
+    self.root = self._parse_or() # nodes: (TERM, string), (AND/OR, [nodes]), (NOT, node)
+    if self.pos < len(self.tokens): raise ValueError('unexpected ' + self.tokens[self.pos][1])
+    self.terms = []          # all the terms
+    self.positive_terms = [] # terms not negated by a NOT (the ones ranking a document)
+    self._collect_terms(self.root, False)
+
+  #
+  # True if the query matches a document containing the found terms (a set)
+  def match(self, found):
+    return self._eval(self.root, lambda term: term in found, all, any, lambda b: not b)
+
+  #
+  # documents matching the query given term_sets (term -> set of the documents containing it) and the set
+  # of all the documents (universe)
+  def match_sets(self, term_sets, universe):
+    return self._eval(self.root, lambda term: term_sets[term], lambda xs: set.intersection(*xs), lambda xs: set.union(*xs), lambda x: universe - x)
+
+  def _eval(self, node, term_f, and_f, or_f, not_f):
+    if node[0] == self.TERM: return term_f(node[1])
+    if node[0] == self.NOT: return not_f(self._eval(node[1], term_f, and_f, or_f, not_f))
+    values = [self._eval(child, term_f, and_f, or_f, not_f) for child in node[1]]
+    return and_f(values) if node[0] == self.AND else or_f(values)
+
+  def _collect_terms(self, node, negated):
+    if node[0] == self.TERM:
+      if node[1] not in self.terms: self.terms.append(node[1])
+      if not negated and node[1] not in self.positive_terms: self.positive_terms.append(node[1])
+    elif node[0] == self.NOT:
+      self._collect_terms(node[1], not negated)
+    else:
+      for child in node[1]: self._collect_terms(child, negated)
+
+  def _peek(self):
+    return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+  def _parse_or(self):
+    nodes = [self._parse_and()]
+    while self._peek() == self.OR:
+      self.pos += 1
+      nodes.append(self._parse_and())
+    return nodes[0] if len(nodes) == 1 else (self.OR, nodes)
+
+  def _parse_and(self):
+    nodes = [self._parse_not()]
+    while self._peek() not in (None, self.OR, ')'):
+      if self._peek() == self.AND: self.pos += 1
+      nodes.append(self._parse_not())
+    return nodes[0] if len(nodes) == 1 else (self.AND, nodes)
+
+  def _parse_not(self):
+    if self._peek() == self.NOT:
+      self.pos += 1
+      return (self.NOT, self._parse_not())
+    return self._parse_primary()
+
+  def _parse_primary(self):
+    kind = self._peek()
+    if kind is None: raise ValueError('incomplete query')
+    value = self.tokens[self.pos][1]
+    self.pos += 1
+    if kind == self.TERM: return (self.TERM, value)
+    if kind == '(':
+      node = self._parse_or()
+      if self._peek() != ')': raise ValueError('missing )')
+      self.pos += 1
+      return node
+    raise ValueError('unexpected ' + value)
+
+#
+# Multi-term matcher: finds which of the terms occur in a text. The text is case folded once (case
+# insensitive terms), then each term is looked for with the substring search of str (the text is already
+# in memory, a pass per term is faster than a combined regex tried at every position)
+class MultiMatcher:
+  def __init__(self, terms, case_insensitive):
+    self.case_insensitive = case_insensitive
+    self.terms = {} # key (folded term) -> terms (original strings)
+    for term in terms:
+      self.terms.setdefault(self._key(term), []).append(term)
+
+  #
+  # set of the terms found in text
+  def find(self, text):
+    if self.case_insensitive:
+      text = text.lower()
+    return set(term for key, terms in self.terms.items() if key in text for term in terms)
+
+  def _key(self, term):
+    return term.lower() if self.case_insensitive else term
+
+#
+# Persistent cache of the extracted text of the documents, kept in the sqlite sidecar (schema 'cache'):
+# doc_text holds the text of each document zlib compressed, keyed by the file identity (url, size, mtime_ns),
+# so an unchanged document is never extracted twice; the least recently used entries are evicted beyond the
+# size budget. It is the only copy of the texts: the full-text index (TextIndex) reads them from here.
+# A document without a text to cache (see extract_text) is kept with a NULL text, so it is not read again
+class TextCache:
+  def __init__(self, db_conn, repo_dir_path, max_size = DEF_TEXT_CACHE_SIZE):
+    self.db_conn = db_conn
+    self.repo_dir_path = repo_dir_path
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self.db_conn.create_function('dcm_unzip', 1, unzip_text, deterministic=True)
+
+  #
+  # create the cache table
+  def create_tables(self):
+    self.db_conn.execute('CREATE TABLE IF NOT EXISTS cache.doc_text (id INTEGER PRIMARY KEY, url TEXT UNIQUE, size INTEGER, mtime_ns INTEGER, data BLOB, used REAL)')
+    self.db_conn.execute('CREATE INDEX IF NOT EXISTS cache.doc_text_used ON doc_text (used)')
+
+  #
+  # text of the document (url, None if it has no text to cache), st is its os.stat result (stat'ed when None);
+  # raise OSError if unreadable
+  def get_text(self, url, st = None):
+    if st is None:
+      st = os.stat(os.path.join(self.repo_dir_path, url))
+    row = self._lookup(url, st)
+    if row is not None:
+      return unzip_text(row[0])
+    text = extract_text(os.path.join(self.repo_dir_path, url))
+    self._store(url, st, text)
+    return text
+
+  #
+  # text of the documents ((url, st) items, st as in get_text) as an iterator of (url, st, text), unreadable
+  # documents are skipped and text is None for the ones without a text to cache (to be searched in place).
+  # The cached texts come first, the others are extracted by a pool of worker threads (the extraction runs in
+  # the pdftotext process or is I/O bound) and yielded as they are ready
+  def iter_texts(self, items, workers = DEF_WORKERS):
+    to_extract = []
+    for url, st in items:
+      row = self._lookup(url, st)
+      if row is None:
+        to_extract.append((url, st))
+      else:
+        yield url, st, unzip_text(row[0])
+
+    # an interruption (Ctrl-C) or an early close stops the running extractions (their texts are not stored)
+    for (url, st), text in iter_map(lambda item, cancel: extract_text(os.path.join(self.repo_dir_path, item[0]), cancel), to_extract, workers):
+      self._store(url, st, text)
+      yield url, st, text
+
+  #
+  # split the documents (urls) in the ones to be read (new, changed or without a cached text), as (url, os.stat
+  # result) items, and the set of the ones with an unchanged cached text (they count as used); the unreadable
+  # ones are left out
+  def stale(self, urls):
+    cached = {}
+    for url, size, mtime_ns in self.db_conn.execute('SELECT url, size, mtime_ns FROM cache.doc_text WHERE data IS NOT NULL'):
+      cached[url] = (size, mtime_ns)
+
+    items = []
+    fresh = set()
+    for url in urls:
+      try:
+        st = os.stat(os.path.join(self.repo_dir_path, url))
+      except OSError:
+        continue
+      if cached.get(url) == (st.st_size, st.st_mtime_ns):
+        fresh.add(url)
+      else:
+        items.append((url, st))
+    now = time.time()
+    self.db_conn.executemany('UPDATE cache.doc_text SET used = ? WHERE url = ?', [(now, url) for url in fresh])
+    return items, fresh
+
+  #
+  # cached row (data) of the document or None (if missing or outdated)
+  def _lookup(self, url, st):
+    row = self.db_conn.execute('SELECT data FROM cache.doc_text WHERE url = ? AND size = ? AND mtime_ns = ?', (url, st.st_size, st.st_mtime_ns)).fetchone()
+    if row is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.db_conn.execute('UPDATE cache.doc_text SET used = ? WHERE url = ?', (time.time(), url))
+    return row
+
+  #
+  # store the extracted text of the document, None if it has none (an update, so the index triggers see the
+  # old text deleted)
+  def _store(self, url, st, text):
+    data = None if text is None else zlib.compress(text.encode('utf-8'))
+    if data is not None and len(data) > self.max_size: return
+    cur = self.db_conn.execute('UPDATE cache.doc_text SET size = ?, mtime_ns = ?, data = ?, used = ? WHERE url = ?', (st.st_size, st.st_mtime_ns, data, time.time(), url))
+    if cur.rowcount == 0:
+      self.db_conn.execute('INSERT INTO cache.doc_text (url, size, mtime_ns, data, used) VALUES (?, ?, ?, ?, ?)', (url, st.st_size, st.st_mtime_ns, data, time.time()))
+
+  #
+  # evict the least recently used entries until the cache fits its budget, then commit
+  def evict(self):
+    total = self.db_conn.execute('SELECT ifnull(sum(length(data)), 0) FROM cache.doc_text').fetchone()[0]
+    if total > self.max_size:
+      urls = []
+      for url, n in self.db_conn.execute('SELECT url, ifnull(length(data), 0) FROM cache.doc_text ORDER BY used'):
+        if total <= self.max_size: break
+        urls.append((url,))
+        total -= n
+      self.db_conn.executemany('DELETE FROM cache.doc_text WHERE url = ?', urls)
+    self.db_conn.commit()
+
+  #
+  # remove a document from the cache
+  def remove(self, url):
+    self.db_conn.execute('DELETE FROM cache.doc_text WHERE url = ?', (url,))
+
+  #
+  # a document was moved/renamed
+  def rename(self, old_url, new_url):
+    self.db_conn.execute('DELETE FROM cache.doc_text WHERE url = ?', (new_url,))
+    self.db_conn.execute('UPDATE cache.doc_text SET url = ? WHERE url = ?', (new_url, old_url))
+
+  #
+  # remove the documents not in the keep set
+  def prune(self, keep_urls):
+    urls = [(row[0],) for row in self.db_conn.execute('SELECT url FROM cache.doc_text') if row[0] not in keep_urls]
+    self.db_conn.executemany('DELETE FROM cache.doc_text WHERE url = ?', urls)
+
+#
+# Full-text index of the repository documents, kept in the sqlite sidecar (schema 'cache') on the texts of
+# the TextCache (doc_text, read decompressed through the doc_body view): doc_fts is an FTS5 trigram index
+# (case insensitive substring search, as the search command does) and doc_rank a word index (unicode61
+# tokenizer) used for the BM25 ranking: its term statistics are kept by FTS5, so ranking doesn't read the
+# documents. Both are external content indexes, so a text is stored once and an evicted text leaves the index
+# (as the documents without a cached text, searched in place)
+class TextIndex:
+  MIN_TERM_LEN = 3 # shorter terms can't use the trigram index
+
+  def __init__(self, db_conn, repo_dir_path, text_cache_size = DEF_TEXT_CACHE_SIZE):
+    self.db_conn = db_conn
+    self.repo_dir_path = repo_dir_path
+    self.text_cache = TextCache(db_conn, repo_dir_path, text_cache_size)
+    self.available = False # FTS5 compiled in sqlite
+
+  #
+  # create the index tables (the FTS tables are kept in sync with doc_text by triggers)
+  def create_tables(self):
+    self.text_cache.create_tables()
+    self.db_conn.execute('CREATE VIEW IF NOT EXISTS cache.doc_body AS SELECT id, dcm_unzip(data) AS body FROM doc_text')
+    try:
+      self.db_conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS cache.doc_fts USING fts5(body, content='doc_body', content_rowid='id', tokenize='trigram')")
+    except sqlite3.OperationalError:
+      return # no FTS5 (or no trigram tokenizer): search scans the files
+    self.db_conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS cache.doc_rank USING fts5(body, content='doc_body', content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+    insert = 'INSERT INTO doc_fts (rowid, body) VALUES (new.id, dcm_unzip(new.data)); INSERT INTO doc_rank (rowid, body) VALUES (new.id, dcm_unzip(new.data));'
+    delete = "INSERT INTO doc_fts (doc_fts, rowid, body) VALUES ('delete', old.id, dcm_unzip(old.data)); INSERT INTO doc_rank (doc_rank, rowid, body) VALUES ('delete', old.id, dcm_unzip(old.data));"
+    self.db_conn.execute('CREATE TRIGGER IF NOT EXISTS cache.doc_text_ai AFTER INSERT ON doc_text BEGIN ' + insert + ' END')
+    self.db_conn.execute('CREATE TRIGGER IF NOT EXISTS cache.doc_text_ad AFTER DELETE ON doc_text BEGIN ' + delete + ' END')
+    self.db_conn.execute('CREATE TRIGGER IF NOT EXISTS cache.doc_text_au AFTER UPDATE OF data ON doc_text BEGIN ' + delete + ' ' + insert + ' END')
+    self.available = True
+
+  #
+  # index the documents (urls) that are new or changed since they were indexed, extracting their text with
+  # workers threads; return False if interrupted (Ctrl-C), the documents indexed so far are kept
+  def update(self, urls, workers = DEF_WORKERS):
+    items, fresh = self.stale(urls)
+    complete = True
+    try:
+      for url, st, body in self.text_cache.iter_texts(items, workers):
+        pass # stored (and indexed) by the cache
+    except KeyboardInterrupt:
+      complete = False
+    self.text_cache.evict()
+    return complete
+
+  #
+  # split the documents (urls) in the ones to be indexed (new or changed), as (url, os.stat result) items,
+  # and the set of the ones up to date in the index; the unreadable ones are left out
+  def stale(self, urls):
+    return self.text_cache.stale(urls)
+
+  #
+  # remove a document from the index
+  def remove(self, url):
+    self.text_cache.remove(url)
+    self.db_conn.commit()
+
+  #
+  # a document was moved/renamed
+  def rename(self, old_url, new_url):
+    self.rename_all([(old_url, new_url)])
+
+  #
+  # documents moved/renamed ((old url, new url) items), in a single transaction
+  def rename_all(self, moves):
+    with self.db_conn:
+      for old_url, new_url in moves:
+        self.text_cache.rename(old_url, new_url)
+
+  #
+  # remove the documents not in the keep set
+  def prune(self, keep_urls):
+    with self.db_conn:
+      self.text_cache.prune(keep_urls)
+
+  #
+  # urls of the documents (a subset of the indexed urls set) matching the query (see Query)
+  def search_query(self, query, case_sensitive, urls):
+    term_sets = {}
+    for term in query.terms:
+      term_sets[term] = self.search(term, case_sensitive) & urls
+    return query.match_sets(term_sets, urls)
+
+  #
+  # BM25 score (higher is better) and snippet of the indexed documents (urls set) containing any of the terms:
+  # url -> (score, snippet)
+  def rank(self, terms, urls):
+    phrases = ['"' + term.replace('"', '""') + '"' for term in terms if re.search(r'\w', term)]
+    if not phrases: return {}
+    sql = "SELECT d.url, bm25(doc_rank), snippet(doc_rank, 0, '[', ']', '...', ?) FROM cache.doc_rank JOIN cache.doc_text d ON d.id = doc_rank.rowid WHERE doc_rank MATCH ?"
+    ranks = {}
+    for url, score, snippet in self.db_conn.execute(sql, (SNIPPET_TOKENS, ' OR '.join(phrases))):
+      if url in urls:
+        ranks[url] = (-score, ' '.join(snippet.split()))
+    return ranks
+
+  #
+  # urls of the indexed documents containing the string s
+  def search(self, s, case_sensitive):
+    if len(s) >= self.MIN_TERM_LEN:
+      sql = 'SELECT d.url FROM cache.doc_fts f JOIN cache.doc_text d ON d.id = f.rowid WHERE doc_fts MATCH ?'
+      params = ['"' + s.replace('"', '""') + '"']
+      if case_sensitive:
+        sql = sql + ' AND instr(dcm_unzip(d.data), ?) > 0'
+        params.append(s)
+    elif case_sensitive:
+      sql = 'SELECT url FROM cache.doc_text WHERE instr(dcm_unzip(data), ?) > 0'
+      params = [s]
+    else:
+      sql = 'SELECT url FROM cache.doc_text WHERE instr(lower(dcm_unzip(data)), ?) > 0'
+      params = [s.lower()]
+    return set(row[0] for row in self.db_conn.execute(sql, params))
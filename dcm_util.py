@@ -1,5 +1,6 @@
 import os
 import shutil
+import hashlib
 import sqlite3
 import traceback
 
@@ -14,8 +15,22 @@ def find_files(base_dir, pattern_tuple):
   for root, dirs, files in os.walk(base_dir):
     for basename in files:
       if basename.endswith(pattern_tuple):
-        rel_filepath = os.path.join(root, basename)
-        yield rel_filepath.strip(base_dir)
+        yield os.path.relpath(os.path.join(root, basename), base_dir)
+
+#
+# Fast content fingerprint of a file: hash of its first, middle and last blocks (whole file if small)
+FINGERPRINT_BLOCK_SIZE = 64*1024
+
+def file_fingerprint(filepath, size, block_size=FINGERPRINT_BLOCK_SIZE):
+  h = hashlib.blake2b(digest_size=16)
+  with open(filepath, 'rb') as file:
+    if size <= 3 * block_size:
+      h.update(file.read())
+    else:
+      for offset in [0, (size - block_size) // 2, size - block_size]:
+        file.seek(offset)
+        h.update(file.read(block_size))
+  return h.hexdigest()
 
 #
 # Safe copy file
@@ -28,6 +43,15 @@ def safe_copy(src_filepath, dst_path):
     #traceback.print_exc() #pro-debug
     return False
 
+#
+# Hash of a file content (sha1 hex digest), read in chunks
+def file_hash(filepath, chunk_size=1024*1024):
+  h = hashlib.sha1()
+  with open(filepath, 'rb') as file:
+    for chunk in iter(lambda: file.read(chunk_size), b''):
+      h.update(chunk)
+  return h.hexdigest()
+
 #
 # Safe remove file
 def safe_remove(filepath):
@@ -100,36 +124,3 @@ def get_sql_andor_quoted(case_sensitive, col_name, value, andFlag):
     return and_or + col_name + ' LIKE ' + quote_str(value)
 
   return and_or + col_name + ' = ' + quote_str(value)
-
-#
-# Search a string in a file (txt/pdf)
-def search_string_in_file(filepath, words, case_insesitve):
-  #--- file ext
-  filename, file_extension = os.path.splitext(filepath)
-  
-  #--- pdf
-  tmp_filepath = '~tmp.tmp'
-  safe_remove(tmp_filepath)
-  if file_extension == '.pdf':
-    cmd = 'pdftotext.exe -nopgbrk "' + filepath + '" ' + tmp_filepath
-    #print(cmd)
-    os.system(cmd)
-    filepath = tmp_filepath
-
-  # text, pdf
-  res = False
-  if case_insesitve:
-    words = words.lower()
-    with open(filepath, 'r') as file:
-      for line in file:
-        if words in line.lower():
-          res = True
-          break
-  else:
-    with open(filepath, 'rb', 0) as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as s:
-      xs = bytes(words, 'utf8')
-      if s.find(xs) != -1:
-        res = True
-  
-  safe_remove(tmp_filepath)
-  return res
@@ -0,0 +1,121 @@
+#
+# dcm_repo regression tests (python -m unittest): journal replay and compaction
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import dcm_repo
+
+class JournalTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.csv_path = os.path.join(self.dir, 'repo.csv')
+    self.repo_dir_path = os.path.join(self.dir, 'repo')
+    os.mkdir(self.repo_dir_path)
+    with open(self.csv_path, 'w', newline='') as file:
+      file.write(dcm_repo.RepoManager.COLS_WRITE.replace(', ', ';') + '\n')
+      file.write('doc;a.pdf;Alpha;01/01/2020;u;en;x y;;\n')
+      file.write('doc;b.pdf;Beta;02/01/2020;u;en;y;;\n')
+      file.write('bookmark;http://c;Gamma;03/01/2020;u;en;z;;\n')
+    self.repo = None
+
+  def tearDown(self):
+    if self.repo is not None: self.repo.db_conn.close()
+    shutil.rmtree(self.dir)
+
+  def open_repo(self, set_aside_journal = None):
+    self.repo = dcm_repo.RepoManager('u', self.csv_path, self.repo_dir_path)
+    return self.repo.open(set_aside_journal)
+
+  #
+  # rows of the resource table (rowid included)
+  def rows(self):
+    return self.repo.db_conn.execute('SELECT rowid, ' + dcm_repo.RepoManager.COLS_WRITE + ' FROM main.resource ORDER BY rowid').fetchall()
+
+  #
+  # the session ends without close(): the journal is left behind
+  def crash(self):
+    self.repo._close_journal()
+    self.repo.db_conn.close()
+    self.repo = None
+
+  #
+  # mutations of every journal record kind
+  def mutate(self):
+    self.repo.add_bookmark_db('http://d', 'Delta;"quoted"|', 'it', 'w y', 'k')
+    self.repo.change_title(1, 'Alpha 2')
+    self.repo.toggle_favorite(2)
+    self.repo.rename_label_db('y', 'yy')
+    self.repo.remove_entry_db_file(3)
+
+  def test_replay_after_crash(self):
+    self.assertTrue(self.open_repo())
+    self.mutate()
+    expected = self.rows()
+    self.crash()
+    self.assertTrue(os.path.exists(self.csv_path + dcm_repo.RepoManager.JOURNAL_SUFFIX))
+
+    self.assertTrue(self.open_repo())
+    self.assertEqual(self.rows(), expected)
+    self.repo.add_bookmark_db('http://e', 'Epsilon', 'en', '', '')
+    expected = self.rows()
+    self.crash()
+
+    # without the sidecar the csv is imported again and the journal replayed
+    os.remove(self.csv_path + dcm_repo.RepoManager.CACHE_SUFFIX)
+    self.assertTrue(self.open_repo())
+    self.assertEqual(self.rows(), expected)
+
+  def test_close_keeps_journal(self):
+    self.assertTrue(self.open_repo())
+    self.mutate()
+    expected = self.rows()
+    self.repo.close()
+    self.repo = None
+    self.assertTrue(os.path.exists(self.csv_path + dcm_repo.RepoManager.JOURNAL_SUFFIX))
+
+    self.assertTrue(self.open_repo())
+    self.assertEqual(self.rows(), expected)
+
+  def test_compaction(self):
+    self.assertTrue(self.open_repo())
+    self.mutate()
+    expected = [row[1:] for row in self.rows()]
+    with unittest.mock.patch.object(dcm_repo.RepoManager, 'JOURNAL_COMPACT_SIZE', 0):
+      self.repo.close()
+    self.repo = None
+    self.assertFalse(os.path.exists(self.csv_path + dcm_repo.RepoManager.JOURNAL_SUFFIX))
+
+    os.remove(self.csv_path + dcm_repo.RepoManager.CACHE_SUFFIX)
+    self.assertTrue(self.open_repo())
+    self.assertEqual([row[1:] for row in self.rows()], expected)
+
+  def test_csv_changed_outside(self):
+    self.assertTrue(self.open_repo())
+    self.mutate()
+    self.crash()
+    journal_path = self.csv_path + dcm_repo.RepoManager.JOURNAL_SUFFIX
+    with open(self.csv_path, 'a', newline='') as file:
+      file.write('doc;e.pdf;Edited;04/01/2020;u;en;;;\n')
+    with open(self.csv_path, newline='') as file:
+      csv_data = file.read()
+
+    # refused: csv and journal untouched
+    self.assertFalse(self.open_repo(lambda path: False))
+    self.repo.db_conn.close()
+    self.repo = None
+    self.assertTrue(os.path.exists(journal_path))
+    with open(self.csv_path, newline='') as file:
+      self.assertEqual(file.read(), csv_data)
+
+    # accepted: the journal is set aside, the csv is used as it is
+    self.assertTrue(self.open_repo(lambda path: True))
+    self.assertFalse(os.path.exists(journal_path))
+    self.assertTrue(os.path.exists(journal_path + '.last'))
+    self.assertEqual([row[3] for row in self.rows()], ['Alpha', 'Beta', 'Gamma', 'Edited'])
+
+if __name__ == '__main__':
+  unittest.main()
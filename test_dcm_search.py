@@ -0,0 +1,121 @@
+#
+# dcm_search regression tests (python -m unittest)
+#
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import dcm_search
+
+#
+# Query parsing and evaluation
+class QueryTest(unittest.TestCase):
+  def test_parse(self):
+    q = dcm_search.Query('sqlite "full text" OR fts NOT (draft OR old)')
+    self.assertEqual(q.root, (q.OR, [
+      (q.AND, [(q.TERM, 'sqlite'), (q.TERM, 'full text')]),
+      (q.AND, [(q.TERM, 'fts'), (q.NOT, (q.OR, [(q.TERM, 'draft'), (q.TERM, 'old')]))])]))
+    self.assertEqual(q.terms, ['sqlite', 'full text', 'fts', 'draft', 'old'])
+    self.assertEqual(q.positive_terms, ['sqlite', 'full text', 'fts'])
+
+  def test_explicit_and(self):
+    q = dcm_search.Query('a AND b c')
+    self.assertEqual(q.root, (q.AND, [(q.TERM, 'a'), (q.TERM, 'b'), (q.TERM, 'c')]))
+
+  def test_double_not(self):
+    q = dcm_search.Query('a NOT NOT b')
+    self.assertEqual(q.positive_terms, ['a', 'b'])
+    self.assertTrue(q.match({'a', 'b'}))
+    self.assertFalse(q.match({'a'}))
+
+  def test_match(self):
+    q = dcm_search.Query('sqlite "full text" OR fts NOT (draft OR old)')
+    self.assertTrue(q.match({'sqlite', 'full text'}))
+    self.assertTrue(q.match({'fts'}))
+    self.assertFalse(q.match({'fts', 'old'}))
+    self.assertFalse(q.match({'sqlite'}))
+    self.assertTrue(q.match({'sqlite', 'full text', 'draft'}))
+
+  def test_match_sets(self):
+    q = dcm_search.Query('(a OR b) NOT c')
+    term_sets = {'a': {1, 2}, 'b': {3}, 'c': {2, 4}}
+    self.assertEqual(q.match_sets(term_sets, {1, 2, 3, 4, 5}), {1, 3})
+
+  def test_errors(self):
+    for text in ['', '   ', '""', '"open phrase', 'a OR', '(a b', 'a )', 'NOT', 'AND a']:
+      with self.assertRaises(ValueError, msg=text):
+        dcm_search.Query(text)
+
+#
+# BytesMatcher: terms across the chunk boundaries
+class BytesMatcherTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def write(self, data):
+    path = os.path.join(self.dir, 'doc.txt')
+    with open(path, 'wb') as file:
+      file.write(data)
+    return path
+
+  def test_chunk_boundaries(self):
+    data = ('x' * 37 + 'Needle' + 'y' * 29 + 'città' + 'z' * 41 + 'tail').encode('utf8')
+    path = self.write(data)
+    terms = ['needle', 'Needle', 'CITTÀ', 'città', 'tail', 'missing']
+    for chunk_size in [1, 2, 3, 5, 8, 64, 4096]:
+      for use_mmap in [True, False]:
+        self.assertEqual(dcm_search.BytesMatcher(terms, False).find_file(path, use_mmap, chunk_size), {'Needle', 'città', 'tail'}, chunk_size)
+        self.assertEqual(dcm_search.BytesMatcher(terms, True).find_file(path, use_mmap, chunk_size), {'needle', 'Needle', 'CITTÀ', 'città', 'tail'}, chunk_size)
+
+  def test_empty_file(self):
+    path = self.write(b'')
+    self.assertEqual(dcm_search.BytesMatcher(['a', ''], True).find_file(path), {''})
+
+#
+# RegexMatcher: chunked search (overlap between the chunks, context before the cut)
+class RegexMatcherTest(unittest.TestCase):
+  def search_chunks(self, matcher, data, chunk_size):
+    chunks = iter([data[i:i + chunk_size] for i in range(0, len(data), chunk_size)])
+    return matcher._search_chunks(matcher.bytes_regex, chunks, b'')
+
+  def test_chunks_match_whole_search(self):
+    data = b'ab xcd cd ' * 300 + b'\nab abab'
+    for pattern in [r'^ab|\bcd', r'(?<=x)cd', r'ab\s+xcd', r'd$', r'b a']:
+      matcher = dcm_search.RegexMatcher(pattern, False, max_hits=10**6)
+      expected = [m.start() for m in matcher.bytes_regex.finditer(data)]
+      with unittest.mock.patch.object(dcm_search, 'REGEX_OVERLAP', 16):
+        for chunk_size in [1, 3, 7, 16, 50, 4096]:
+          self.assertEqual(self.search_chunks(matcher, data, chunk_size), expected, (pattern, chunk_size))
+
+  def test_no_spurious_match_at_cut(self):
+    data = b'xab' * 100
+    matcher = dcm_search.RegexMatcher(r'^ab|\bab', False)
+    with unittest.mock.patch.object(dcm_search, 'REGEX_OVERLAP', 4):
+      for chunk_size in [1, 2, 3, 5, 8]:
+        self.assertEqual(self.search_chunks(matcher, data, chunk_size), [], chunk_size)
+
+  def test_max_hits(self):
+    matcher = dcm_search.RegexMatcher('a', False, max_hits=3)
+    with unittest.mock.patch.object(dcm_search, 'REGEX_OVERLAP', 2):
+      self.assertEqual(self.search_chunks(matcher, b'.a' * 20, 3), [1, 3, 5])
+
+  def test_text_chunks(self):
+    text = 'perché no? Perché sì. ' * 50
+    matcher = dcm_search.RegexMatcher('perché', True, whole_word=True, is_regex=False, max_hits=1000)
+    expected = [m.start() for m in re.finditer('perché', text, re.IGNORECASE)]
+    with unittest.mock.patch.object(dcm_search, 'REGEX_OVERLAP', 8):
+      chunks = iter([text[i:i + 13] for i in range(0, len(text), 13)])
+      self.assertEqual(matcher._search_chunks(matcher.text_regex, chunks, ''), expected)
+
+  def test_invalid_pattern(self):
+    with self.assertRaises(ValueError):
+      dcm_search.RegexMatcher('(a', False)
+
+if __name__ == '__main__':
+  unittest.main()